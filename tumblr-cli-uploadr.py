@@ -4,47 +4,135 @@ __VERSION__ = '2020.08.04'
 
 __ABOUT__   = '= tubmlr - command line uploader = (c) 2019 by Robert = version %s =' % __VERSION__
 
-import os, sys
+import os, sys, time, json
+
+# startup timing
+#
+STARTUP = [('start', time.time())]
 
 __usage__ = """
 %(about)s
 
-usage: %(exe)s action file "caption" "tag1,tag2"
+usage: %(exe)s [--limit=N] [--dry-run] [--import-timing] [--metrics] [--profile[=file]] [--progress] [--jsonl[=fields]] action file "caption" "tag1,tag2"
 
-action  ... photo, video, delete, find-tag, find-id
-file    ... media file to upload
+action  ... photo, video, batch, delete, find-tag, find-id
+file    ... media file to upload (directory or glob pattern for batch)
 caption ... markdown formatted text for caption
 tags    ... comma separated values for tags
 
+--limit=N ... process max N posts for list-posts, list-tag all, find-tag, delete-tagged, export (default all posts)
+--dry-run ... only report planned deletes and tag edits of bulk actions, planned date and tags of batch uploads
+--import-timing ... report where startup time goes (imports, config, auth)
+--metrics ... print JSON summary of request latencies, upload phases (read phase only with manifest_db), bytes sent, polls and error codes
+--profile[=file] ... run action under cProfile, print top functions (or save stats to file for pstats/snakeviz)
+--progress ... show photo/video progress (# per 10%% sent, . per processing poll, ! timeout)
+--jsonl[=fields] ... print one compact JSON line per post for list-posts, list-tag, find-tag, find-id as pages arrive,
+                     fields = comma separated names (id,type,state,timestamp,tags,url,date,blog,slug,summary,notes,photo,video)
+                     or name=/xpath pairs (default id,type,state,timestamp,tags,url),
+                     timing, metrics, profile and stats reports go to stderr
+
 for configurable options check config file: %(cfg)s
  
 example:
 %(exe)s find-id id              ... find post id and print full json
-%(exe)s find-tag tag            ... find the last 20 post(s) tagged with tag tag and print only post id(s)
+%(exe)s find-tag tag            ... find all post(s) tagged with tag tag and print only post id(s)
 %(exe)s list-tag id             ... list all tags for post id
-%(exe)s list-tag all            ... list all tags for all (the last 20) posts (all = * = -)
-%(exe)s list-posts              ... list all (the last 20) posts (print only post id(s))
-%(exe)s delete-id id            ... delete post id
-%(exe)s delete-id all           ... delete all (the last 20) posts (all = * = -)
-%(exe)s delete-tagged tag       ... delete all (the last 20) post tagged with tag tag
-%(exe)s add-tag tag1,tag2 id    ... add tag1 and tag2 to post id
-%(exe)s del-tag tag1,tag2 id    ... delete tag1 and tag2 from post id
+%(exe)s list-tag all            ... list all tags for all posts (all = * = -)
+%(exe)s list-posts              ... list all posts (print only post id(s))
+%(exe)s delete-id id            ... delete post id (or comma separated list of ids)
+%(exe)s delete-id all           ... delete all posts (all = * = -)
+%(exe)s delete-tagged tag       ... delete all post(s) tagged with tag tag
+%(exe)s add-tag tag1,tag2 id    ... add tag1 and tag2 to post id (or comma separated list of ids)
+%(exe)s del-tag tag1,tag2 id    ... delete tag1 and tag2 from post id (or comma separated list of ids)
+%(exe)s add-tag-tagged tag1,tag2 tag ... add tag1 and tag2 to all post(s) tagged with tag tag
+%(exe)s del-tag-tagged tag1,tag2 tag ... delete tag1 and tag2 from all post(s) tagged with tag tag
 %(exe)s photo file caption tags ... uploads photo file with caption and tags and print post id and url
 %(exe)s video file caption tags ... uploads video file with caption and tags and print post id and url
+%(exe)s sync [full]             ... sync local index with new posts (full = all posts, remove deleted ones)
+%(exe)s batch dir caption tags   ... uploads all photos/videos from dir (or "glob") concurrently and print id and url per file
+%(exe)s fanout file caption tags  ... uploads photo/video file to blog_name and all blogs from config concurrently and print id and url per blog
+%(exe)s resume                  ... finish uploads interrupted by crash from journal_file (no media is sent again for created posts)
+%(exe)s session [file]          ... run commands (CLI syntax or JSON lines) from file (default stdin) in one pooled session, JSON line results
+%(exe)s watch spooldir          ... watch spooldir and upload files as they land (caption/tags from tumblr-rules.json)
+%(exe)s export dir              ... export all posts to dir/posts.jsonl and download their photos/videos to dir/media (only new media)
 """ % { 'about': __ABOUT__, 'exe': os.path.basename(sys.argv[0]), 'cfg': os.path.basename(sys.argv[0]).replace('.py', '.json') }
 
+# action -> number of required parameters (checked before config and auth)
+#
+ACTIONS = dict(
+    [(action, 1) for action in ['list-posts', 'list-id', 'sync', 'sync-index', 'session', 'run', 'resume']] +
+    [(action, 2) for action in ['list-tag', 'list-tags', 'del-id', 'delete-id', 'rm-id', 'remove-id',
+                                'del-tagged', 'delete-tagged', 'rm-tagged', 'remove-tagged',
+                                'find', 'find-tag', 'tag', 'id', 'find-id', 'watch', 'spool', 'daemon',
+                                'export', 'mirror', 'backup']] +
+    [(action, 3) for action in ['add-tag', 'add-tags', 'del-tag', 'del-tags', 'rm-tag', 'rm-tags',
+                                'add-tag-tagged', 'add-tags-tagged', 'del-tag-tagged', 'del-tags-tagged',
+                                'rm-tag-tagged', 'rm-tags-tagged']] +
+    [(action, 4) for action in ['photo', 'image', 'picture', 'video', 'vid', 'avi', 'mp4', 'batch', 'dir', 'upload-batch',
+                                'fanout', 'fan-out', 'multi-blog']]
+)
+
 # debug (verbosity) level
 #
 DBG = 0
 
 import tumblrsimple
 
+STARTUP.append(('import tumblrsimple', time.time()))
+
 
 def die(msg, exitcode=1):
     """ print msg and die with exitcode """
     print(msg)
     sys.exit(exitcode)
 
+def option(name, default=None):
+    """ remove --name=value (or --name flag) from command line and return value (True for flag) or default """
+    for arg in sys.argv[1:]:
+        if arg == '--' + name or arg.startswith('--' + name + '='):
+            sys.argv.remove(arg)
+            return arg.split('=', 1)[1] if '=' in arg else True
+    return default
+
+def print_jsonl(records):
+    """ print records (dicts) as compact JSON lines as they come """
+    for rec in records:
+        print(json.dumps(rec, separators=(',', ':')), flush=True)
+
+def bulk_delete(tumblr, query=None, ids=None, limit=None, dry_run=False):
+    """ delete (or plan to delete) posts tagged with query or list of ids and print report, die if any error """
+    deleted, errors = [], 0
+    for id, ok, err in tumblr.bulk_delete(query=query, ids=ids, limit=limit, dry_run=dry_run):
+        if err:
+            print("ID:", id, err)
+            errors += 1
+            continue
+        deleted.append(id)
+    if not tumblr.response_is_ok():
+        die(tumblr.last_error())
+    print("PLANNED DELETEs: %d IDs:" % len(deleted) if dry_run else "DELETED IDs:", ' '.join(["%s" % id for id in deleted]))
+    if errors:
+        die("ERRORs: %d" % errors)
+
+def bulk_tags(tumblr, addtags=None, deltags=None, query=None, ids=None, limit=None, dry_run=False):
+    """ edit (or plan to edit) tags of posts tagged with query or list of ids and print report, die if any error """
+    edited, errors = 0, 0
+    for id, result, err in tumblr.bulk_tags(addtags=addtags, deltags=deltags, query=query, ids=ids, limit=limit, dry_run=dry_run):
+        if err:
+            print("ID:", id, err)
+            errors += 1
+            continue
+        # unchanged
+        if result is True:
+            continue
+        edited += 1
+        print("PLAN ID:" if dry_run else "ID:", id, "TAGs:", ' '.join(["%s" % tag for tag in result]))
+    if not tumblr.response_is_ok():
+        die(tumblr.last_error())
+    print("PLANNED EDITs:" if dry_run else "EDITED:", edited)
+    if errors:
+        die("ERRORs: %d" % errors)
+
 def usage(required=4):
     """ show usage if not enough parameters supplied """
     # just return if we have all required parameters
@@ -60,15 +148,59 @@ def usage(required=4):
 #
 if __name__ == '__main__':
 
+    # options
+    #
+    limit = option('limit')
+    dry_run = option('dry-run', False)
+    import_timing = option('import-timing', False)
+    metrics = option('metrics', False)
+    profile = option('profile', False)
+    progress = ('.', '!', '#') if option('progress', False) else None
+    jsonl = option('jsonl', False)
+
     # parameters (min 1 required)
     #
     usage(required=1)
     action = sys.argv[1].lower()
 
+    # local usage errors before config and auth
+    #
+    if action not in ACTIONS:
+        die(__usage__)
+    usage(required=ACTIONS[action])
+    if limit is not None:
+        # --limit=N with N > 0 (bare --limit is True)
+        if limit is True or not limit.isdigit() or not int(limit):
+            die(__usage__)
+        limit = int(limit)
+    if jsonl:
+        try:
+            fields = tumblrsimple.Projection.parse_fields(None if jsonl is True else jsonl)
+        except ValueError as e:
+            die("ERROR: --jsonl %s" % e)
+
     # verbosity/debug level
     #
     tumblrsimple.TumblrSimple.verbosity = DBG
 
+    # reports (timing, metrics, profile, API calls) go to stderr for --jsonl, so stdout is pure JSON lines
+    report = sys.stderr if jsonl else sys.stdout
+
+    # optional profiling of whole run (report also after die)
+    #
+    if profile:
+        import cProfile, pstats, atexit
+        profiler = cProfile.Profile()
+        def profile_report():
+            profiler.disable()
+            if profile is True:
+                pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(25)
+            else:
+                profiler.dump_stats(profile)
+                print("PROFILE:", profile, file=report)
+        atexit.register(profile_report)
+        profiler.enable()
+
     # simple tumblr from cfg file
     #
     cfgfile = tumblrsimple.TumblrSimple.cfg_filename(sys.argv[0])
@@ -76,36 +208,57 @@ if __name__ == '__main__':
     #
     if not tumblr:
         die("ERROR: broken/missing config file: %s" % cfgfile)
+    STARTUP.append(('read config', time.time()))
+
+    # export metrics (options metrics_json, metrics_prom) at exit - also after die
+    #
+    import atexit
+    atexit.register(tumblr.save_metrics)
 
     # suppress warnings: InsecurePlatformWarning, SNIMissingWarning for older libraries
     #
     #tumblr.no_warnings()
 
-    # validate authorization
+    # validate authorization (cached for options auth_cache_ttl)
     #
-    if not tumblr.info_rq():
+    if not tumblr.info_cached_rq():
         die(tumblr.last_error())
+    STARTUP.append(('auth %s' % ('request' if tumblr.api_rq_cnt else 'cached'), time.time()))
 
     # LIST-POSTS
     #
-    if action in ['list-posts', 'list-id']:
-        ids = tumblr.list_posts_ids()
-        if not ids:
+    if action in ['list-posts', 'list-id'] and jsonl:
+        print_jsonl(tumblr.iter_records(fields, limit=limit))
+        if not tumblr.response_is_ok():
+            die(tumblr.last_error())
+    elif action in ['list-posts', 'list-id']:
+        print("IDs:", end='')
+        for rec in tumblr.iter_posts(limit=limit, projection={'id': '/id'}):
+            print(" %s" % rec.id, end='', flush=True)
+        print()
+        if not tumblr.response_is_ok():
             die(tumblr.last_error())
-        print("IDs:", ' '.join(["%s" % id for id in ids]))
 
     # LIST-TAG id
     #
     if action in ['list-tag', 'list-tags']:
         usage(required=2)
         id = sys.argv[2]
-        if id in ['*', 'all', '-']:
-            id_tags = tumblr.list_posts_tags()
-            if not id_tags:
+        if id in ['*', 'all', '-'] and jsonl:
+            print_jsonl(tumblr.iter_records(fields, limit=limit))
+            if not tumblr.response_is_ok():
+                die(tumblr.last_error())
+        elif jsonl:
+            post = tumblr.find_id_get_post(id=id)
+            if not post:
                 die(tumblr.last_error())
-            for id,tags in id_tags.items():
+            print_jsonl([tumblrsimple.Projection(fields).project(post).as_dict()])
+        elif id in ['*', 'all', '-']:
+            for id,tags in tumblr.iter_posts_tags(limit=limit):
                 print("ID:", id, end=' ')
                 print("TAGs:", ' '.join(["%s" % tag for tag in tags]))
+            if not tumblr.response_is_ok():
+                die(tumblr.last_error())
         else:
             tags = tumblr.find_id_get_tags(id=id)
             if not tags:
@@ -118,23 +271,22 @@ if __name__ == '__main__':
     if action in ['del-id', 'delete-id', 'rm-id', 'remove-id']:
         usage(required=2)
         par = sys.argv[2]
-        id = None if par in ['*', 'all', '-'] else par
-        if not tumblr.delete_post_rq(id=id):
-            die(tumblr.last_error())
-        print("DELETED ID:", id)
+        # all posts or list of ids
+        if par in ['*', 'all', '-'] or ',' in par or dry_run:
+            ids = None if par in ['*', 'all', '-'] else par.split(',')
+            bulk_delete(tumblr, ids=ids, limit=limit, dry_run=dry_run)
+        else:
+            id = par
+            if not tumblr.delete_post_rq(id=id):
+                die(tumblr.last_error())
+            print("DELETED ID:", id)
 
     # DELETE tagged
     #
     if action in ['del-tagged', 'delete-tagged', 'rm-tagged', 'remove-tagged']:
         usage(required=2)
         par = sys.argv[2]
-        ids = tumblr.find_tag_get_ids(tag=par)
-        if not ids:
-            die(tumblr.last_error())
-        for id in ids:
-            if not tumblr.delete_post_rq(id=id):
-                die(tumblr.last_error())
-        print("DELETED IDs:", ' '.join(["%s" % id for id in ids]))
+        bulk_delete(tumblr, query=par, limit=limit, dry_run=dry_run)
 
     # FIND-TAG tag
     #
@@ -142,11 +294,16 @@ if __name__ == '__main__':
         usage(required=2)
         par = sys.argv[2]
         tag = None if par in ['*', 'all', '-'] else par
-        ids = tumblr.find_tag_get_ids(tag=tag)
-        print("TAG: #%s" % tag)
-        if not ids:
+        if jsonl:
+            print_jsonl(tumblr.iter_records(fields, tag=tag, limit=limit))
+        else:
+            print("TAG: #%s" % tag)
+            print("IDs:", end='')
+            for id in tumblr.iter_tagged_ids(tag=tag, limit=limit):
+                print(" %s" % id, end='', flush=True)
+            print()
+        if not tumblr.response_is_ok():
             die(tumblr.last_error())
-        print("IDs:", ' '.join(["%s" % id for id in ids]))
 
     # FIND-ID id
     #
@@ -156,7 +313,10 @@ if __name__ == '__main__':
         post = tumblr.find_id_get_post(id=id)
         if not post:
             die(tumblr.last_error())
-        tumblr.debug_json(0, "post[%s]" % id, post)
+        if jsonl:
+            print_jsonl([tumblrsimple.Projection(fields).project(post).as_dict()])
+        else:
+            tumblr.debug_json(0, "post[%s]" % id, post)
 
     # ADD-TAG tag1,tag2 id
     #
@@ -164,10 +324,14 @@ if __name__ == '__main__':
         usage(required=3)
         tags = sys.argv[2]
         id   = sys.argv[3]
-        post = tumblr.id_add_tags(id=id, addtags=tags)
-        if not post:
-            die(tumblr.last_error())
-        print("ID:",id,"+TAGS:",tags)
+        # list of ids
+        if ',' in id or dry_run:
+            bulk_tags(tumblr, addtags=tags, ids=id.split(','), dry_run=dry_run)
+        else:
+            post = tumblr.id_add_tags(id=id, addtags=tags)
+            if post is None:
+                die(tumblr.last_error())
+            print("ID:",id,"+TAGS:",tags)
 
     # DEL-TAG tag1,tag2 id
     #
@@ -175,10 +339,30 @@ if __name__ == '__main__':
         usage(required=3)
         tags = sys.argv[2]
         id   = sys.argv[3]
-        post = tumblr.id_del_tags(id=id, deltags=tags)
-        if not post:
-            die(tumblr.last_error())
-        print("ID:", id, "-TAGS:", tags)
+        # list of ids
+        if ',' in id or dry_run:
+            bulk_tags(tumblr, deltags=tags, ids=id.split(','), dry_run=dry_run)
+        else:
+            post = tumblr.id_del_tags(id=id, deltags=tags)
+            if post is None:
+                die(tumblr.last_error())
+            print("ID:", id, "-TAGS:", tags)
+
+    # ADD-TAG-TAGGED tag1,tag2 tag
+    #
+    if action in ['add-tag-tagged', 'add-tags-tagged']:
+        usage(required=3)
+        tags = sys.argv[2]
+        par  = sys.argv[3]
+        bulk_tags(tumblr, addtags=tags, query=par, limit=limit, dry_run=dry_run)
+
+    # DEL-TAG-TAGGED tag1,tag2 tag
+    #
+    if action in ['del-tag-tagged', 'del-tags-tagged', 'rm-tag-tagged', 'rm-tags-tagged']:
+        usage(required=3)
+        tags = sys.argv[2]
+        par  = sys.argv[3]
+        bulk_tags(tumblr, deltags=tags, query=par, limit=limit, dry_run=dry_run)
 
     # PHOTO file caption tags
     #
@@ -187,7 +371,8 @@ if __name__ == '__main__':
         usage(required=4)
         photo, caption, tags = sys.argv[2], sys.argv[3], sys.argv[4]
         # upload
-        idurl = tumblr.upload_photo_get_id_url(photo, caption, tags)
+        idurl = tumblr.upload_photo_get_id_url(photo, caption, tags, progress=progress)
+        if progress: print()
         if not idurl:
             die(tumblr.last_error())
         #
@@ -196,6 +381,7 @@ if __name__ == '__main__':
         print("TAGs:", tags)
         print("ID:",  idurl['id'])
         print("URL:", idurl['url'])
+        print("POLLs:", idurl['polls'])
 
     # VIDEO
     #
@@ -204,7 +390,8 @@ if __name__ == '__main__':
         usage(required=4)
         video, caption, tags = sys.argv[2], sys.argv[3], sys.argv[4]
         # upload
-        idurl = tumblr.upload_video_get_id_url(video, caption, tags)
+        idurl = tumblr.upload_video_get_id_url(video, caption, tags, progress=progress)
+        if progress: print()
         if not idurl:
             die(tumblr.last_error())
         #
@@ -213,7 +400,158 @@ if __name__ == '__main__':
         print("TAGs:", tags)
         print("ID:",  idurl['id'])
         print("URL:", idurl['url'])
+        print("POLLs:", idurl['polls'])
+
+    # SYNC [full]
+    #
+    if action in ['sync', 'sync-index']:
+        if not tumblr.index:
+            die("ERROR: local index not configured (options index_db)")
+        full = len(sys.argv) > 2 and sys.argv[2] == 'full'
+        synced = tumblr.sync_index(full=full)
+        if synced is None:
+            die(tumblr.last_error())
+        print("SYNCED:", synced, "INDEXED:", tumblr.index.count())
+
+    # BATCH dir|glob caption tags
+    #
+    if action in ["batch", "dir", "upload-batch"]:
+        # 4 pars required
+        usage(required=4)
+        pattern, caption, tags = sys.argv[2], sys.argv[3], sys.argv[4]
+        # media files from dir or glob
+        medias = tumblr.media_files(pattern)
+        if not medias:
+            die("ERROR: no media files found: %s" % pattern)
+        # uploads over daily quota are scheduled (spread) over the allowed window
+        if tumblr.limiter:
+            eta = tumblr.limiter.eta(tumblr.media_type(medias[0]), n=len(medias))
+            if eta > 0:
+                print("SCHEDULED: %d uploads over quota, ETA %.1f hours" % (len(medias), eta / 3600))
+        # dry run - only planned date and tags per file (metadata scanned in parallel, cached in meta_db)
+        if dry_run:
+            for plan in tumblr.plan_batch(medias, tags):
+                print("PLAN:", plan['media'], plan['type'].upper(), "SIZE:", plan['size'], "DATE:", plan['date'], "TAGs:", ','.join(plan['tags']))
+            print("PLANNED UPLOADs:", len(medias))
+        # concurrent upload, results as each file finishes
+        else:
+            uploaded = 0
+            for media, idurl, err in tumblr.upload_batch(medias, caption, tags):
+                if not idurl:
+                    print("MEDIA:", media, err)
+                    continue
+                uploaded += 1
+                print("MEDIA:", media, "ID:", idurl['id'], "URL:", idurl['url'], "POLLs:", idurl['polls'], "(EXISTING)" if idurl.get('existing') else '')
+            #
+            print("UPLOADED: %d/%d" % (uploaded, len(medias)))
+
+    # FANOUT file caption tags - to all blogs
+    #
+    if action in ["fanout", "fan-out", "multi-blog"]:
+        # 4 pars required
+        usage(required=4)
+        media, caption, tags = sys.argv[2], sys.argv[3], sys.argv[4]
+        if not tumblr.media_type(media):
+            die("ERROR: unknown media type: %s" % media)
+        # concurrent upload, results as each blog finishes
+        uploaded, errors = 0, 0
+        for blog, idurl, err in tumblr.upload_fanout(media, caption, tags):
+            if not idurl:
+                print("BLOG:", blog, err)
+                errors += 1
+                continue
+            uploaded += 1
+            print("BLOG:", blog, "ID:", idurl['id'], "URL:", idurl['url'], "POLLs:", idurl['polls'], "(EXISTING)" if idurl.get('existing') else '')
+        #
+        print("UPLOADED: %d/%d" % (uploaded, uploaded + errors))
+        if errors:
+            die("ERRORs: %d" % errors)
+
+    # RESUME - unfinished uploads from journal
+    #
+    if action in ["resume"]:
+        if not tumblr.journal:
+            die("ERROR: journal_file is not configured")
+        resumed, errors = 0, 0
+        for entry, idurl, err in tumblr.resume_uploads():
+            if not idurl:
+                print("MEDIA:", entry['media'], "PHASE:", entry['phase'], err)
+                errors += 1
+                continue
+            resumed += 1
+            print("MEDIA:", entry['media'], "PHASE:", entry['phase'], "ID:", idurl['id'], "URL:", idurl['url'], "POLLs:", idurl['polls'])
+        #
+        print("RESUMED: %d/%d" % (resumed, resumed + errors))
+
+    # SESSION [file] - commands from file or stdin
+    #
+    if action in ["session", "run"]:
+        import tumblrsession
+        source = open(sys.argv[2], "r") if len(sys.argv) > 2 and sys.argv[2] != '-' else sys.stdin
+        # one connection pool for all commands
+        tumblr.use_session()
+        errors = 0
+        for result in tumblrsession.SessionRunner(tumblr, limit=limit).run(source):
+            errors += 0 if result['ok'] else 1
+            print(json.dumps(result))
+            sys.stdout.flush()
+        if errors:
+            print("ERRORs: %d" % errors)
+
+    # WATCH spooldir
+    #
+    if action in ["watch", "spool", "daemon"]:
+        usage(required=2)
+        spool = sys.argv[2]
+        if not os.path.isdir(spool):
+            die("ERROR: spool directory not found: %s" % spool)
+        import tumblrwatch
+        print("WATCH:", spool)
+        try:
+            tumblrwatch.SpoolWatcher(tumblr, spool).run()
+        except KeyboardInterrupt:
+            pass
+
+    # EXPORT dir - posts and media backup
+    #
+    if action in ["export", "mirror", "backup"]:
+        usage(required=2)
+        import tumblrexport
+        export = tumblrexport.BlogExport(tumblr, sys.argv[2])
+        stats, size = dict([(status, 0) for status in ('downloaded', 'resumed', 'skipped', 'error')]), 0
+        for res in export.run(limit=limit):
+            if res['error']:
+                print("MEDIA:", res['url'], "ID:", res['id'], res['error'])
+                stats['error'] += 1
+                continue
+            stats[res['status']] += 1
+            size += res['bytes']
+            if res['status'] != 'skipped':
+                print("MEDIA:", res['url'], "ID:", res['id'], "FILE:", res['path'], res['status'].upper(), "BYTEs:", res['bytes'], flush=True)
+        #
+        print("EXPORTED: %d posts, media downloaded: %d resumed: %d skipped: %d errors: %d, %d bytes" %
+              (export.posts, stats['downloaded'], stats['resumed'], stats['skipped'], stats['error'], size))
+        if not tumblr.response_is_ok():
+            die(tumblr.last_error())
+        if stats['error']:
+            die("ERRORs: %d" % stats['error'])
+
+    # startup timing report
+    #
+    if import_timing:
+        STARTUP.append(('action %s' % action, time.time()))
+        for (name, stamp), (prev, prevstamp) in zip(STARTUP[1:], STARTUP):
+            print("TIMING: %-24s %8.1f ms" % (name, (stamp - prevstamp) * 1000), file=report)
+        for name, sec in tumblrsimple.TumblrSimple.timing.items():
+            print("TIMING: %-24s %8.1f ms (lazy)" % (name, sec * 1000), file=report)
+        print("TIMING: use python3 -X importtime for per module import times", file=report)
+
+    # metrics summary
+    #
+    if metrics:
+        print(json.dumps(tumblr.metrics.summary(), indent=4, sort_keys=True), file=report)
 
     # API calls stats
     #
-    print("Done - Tumblr.API calls:", tumblr.api_rq_cnt)
+    print("Done - Tumblr.API calls:", tumblr.api_rq_cnt, "retries:", tumblr.api_retry_cnt, "quota: %s" % tumblr.limiter.quota_str() if tumblr.limiter else '',
+          file=report)
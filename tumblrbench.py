@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+
+"""
+throughput benchmark of TumblrSimple library and tumblr-cli-uploadr CLI against local MockTumblr server
+
+reports uploads/sec, API calls per upload, retries and p50/p99 upload and request latencies:
+
+    python3 tumblrbench.py [--n=50] [--workers=8] [--latency=0.05] [--photo-delay=0.5] [--video-delay=2]
+                           [--error-rate=0] [--error-status=503] [--poll=fixed] [--poll-batch=1] [--videos=0] [--json]
+
+--check-paging checks that listings by both cursors return every post exactly once, also with more posts
+in one second than fit in a page (exit code 1 on failure):
+
+    python3 tumblrbench.py --check-paging
+
+"""
+
+__VERSION__ = '2020.08.04'
+
+import os, sys, json, time, shutil, tempfile, subprocess
+
+import tumblrsimple, tumblrmock
+
+
+def percentile(values, p):
+    """ p-th percentile of list of values, None for empty list """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else None
+
+
+def make_media(folder, photos, videos, size=64 * 1024):
+    """ create photos and videos (random bytes, the mock does not decode them) in folder, return list of paths """
+    os.makedirs(folder, exist_ok=True)
+    medias = []
+    for i in range(photos + videos):
+        path = os.path.join(folder, "BENCH20200804T%06d.%s" % (i, 'JPG' if i < photos else 'MP4'))
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        medias.append(path)
+    return medias
+
+
+def make_options(url, tmp, poll, workers):
+    """ options for mock server - short waits, caches in tmp, batched status polling by --poll-batch """
+    return {
+        "api_host":         url,
+        "photo_url":        "/posts[0]/photos[0]/original_size/url",
+        "video_url":        "/posts[0]/video_url",
+        "photo_wait":       0.1,
+        "video_wait":       0.25,
+        "loop_wait":        400,
+        "poll":             poll,
+        "poll_initial":     0.05,
+        "poll_history":     os.path.join(tmp, "poll-history.json"),
+        "poll_batch":       bool(tumblrmock.option('poll-batch', 1)),
+        "poll_batch_interval": 0.1,
+        "retry_initial":    0.05,
+        "batch_workers":    workers,
+        "tag_min_len":      3,
+        "tag_max_cnt":      20,
+        "cache_dir":        os.path.join(tmp, "cache")
+    }
+
+
+def bench_library(url, medias, tmp, poll, workers):
+    """ upload medias with TumblrSimple.pool_map, return report dict """
+    tumblr = tumblrsimple.TumblrSimple({"key": "k", "secret": "s"}, {"token": "t", "token_secret": "x"}, "mock",
+                                       make_options(url, tmp, poll, workers))
+
+    def upload(twin, media):
+        start = time.time()
+        idurl = twin.upload_media_get_id_url(media, "bench", "bench")
+        if idurl: idurl['seconds'] = time.time() - start
+        return idurl
+
+    start, latencies, errors = time.time(), [], 0
+    for media, idurl, err in tumblr.pool_map(upload, medias, workers):
+        if idurl:
+            latencies.append(idurl['seconds'])
+        else:
+            errors += 1
+    elapsed = time.time() - start
+    rq = tumblr.metrics.summary()['histograms'].get('rq_seconds', {})
+    return {
+        'path':             'library',
+        'uploads':          len(latencies),
+        'errors':           errors,
+        'seconds':          round(elapsed, 3),
+        'uploads_per_sec':  round(len(latencies) / elapsed, 2) if elapsed else None,
+        'api_calls':        tumblr.api_rq_cnt,
+        'calls_per_upload': round(tumblr.api_rq_cnt / len(medias), 2),
+        'retries':          tumblr.api_retry_cnt,
+        'upload_p50':       percentile(latencies, 0.50),
+        'upload_p99':       percentile(latencies, 0.99),
+        'rq_p50':           dict([(labels, hist['p50']) for labels, hist in rq.items()]),
+        'rq_p99':           dict([(labels, hist['p99']) for labels, hist in rq.items()])
+    }
+
+
+def bench_cli(url, medias, tmp, poll, workers):
+    """ upload medias with tumblr-cli-uploadr.py batch in subprocess, return report dict """
+    exe = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tumblr-cli-uploadr.py')
+    cfg = {
+        "consumer":     {"key": "k", "secret": "s"},
+        "oauth":        {"token": "t", "token_secret": "x"},
+        "blog_name":    "mock",
+        "options":      dict(make_options(url, tmp, poll, workers), metrics_json=os.path.join(tmp, "cli-metrics.json"))
+    }
+    with open(os.path.join(tmp, 'tumblr-cli-uploadr.json'), "w") as f:
+        f.write(json.dumps(cfg, indent=4))
+    start = time.time()
+    out = subprocess.run([sys.executable, exe, 'batch', os.path.dirname(medias[0]), 'bench', 'bench'], cwd=tmp,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout.decode('utf-8', 'replace')
+    elapsed = time.time() - start
+    uploads = len([line for line in out.splitlines() if line.startswith("MEDIA:") and " ID: " in line])
+    done = [line.split() for line in out.splitlines() if line.startswith("Done - Tumblr.API calls:")]
+    with open(cfg["options"]["metrics_json"], "r") as f:
+        hists = json.loads(f.read())['histograms']
+    # whole upload latency timed by the CLI process (without process startup and auth)
+    rq, upload = hists.get('rq_seconds', {}), hists.get('upload_seconds', {}).get('', {})
+    return {
+        'path':             'cli',
+        'uploads':          uploads,
+        'errors':           len(medias) - uploads,
+        'seconds':          round(elapsed, 3),
+        'uploads_per_sec':  round(uploads / elapsed, 2) if elapsed else None,
+        'api_calls':        int(done[0][4]) if done else None,
+        'calls_per_upload': round(int(done[0][4]) / len(medias), 2) if done else None,
+        'retries':          int(done[0][6]) if done else None,
+        'upload_p50':       upload.get('p50'),
+        'upload_p99':       upload.get('p99'),
+        'rq_p50':           dict([(labels, hist['p50']) for labels, hist in rq.items()]),
+        'rq_p99':           dict([(labels, hist['p99']) for labels, hist in rq.items()])
+    }
+
+
+def check_paging(per_second=45, seconds=3, page=20):
+    """ list posts by offset and before cursors (with/without prefetch, tagged, limited), return list of failures """
+    mock = tumblrmock.MockTumblr(page_limit=page)
+    url = mock.start()
+    now, failures = int(time.time()), []
+    with mock.lock:
+        for i in range(per_second * seconds):
+            mock.new_post('photo', ['paging'], now - seconds + i // per_second, visible=0)
+    expected = sorted(mock.posts)
+    try:
+        for cursor in ('offset', 'before'):
+            for prefetch in (True, False):
+                options = {"api_host": url, "page_cursor": cursor, "page_prefetch": prefetch, "page_size": page}
+                tumblr = tumblrsimple.TumblrSimple({"key": "k", "secret": "s"}, {"token": "t", "token_secret": "x"}, "mock", options)
+                for name, ids, want in (
+                        ('all', [post["id"] for post in tumblr.iter_posts()], expected),
+                        ('tag', [rec.id for rec in tumblr.iter_posts(tag='paging', projection={'id': '/id'})], expected),
+                        ('limit', [post["id"] for post in tumblr.iter_posts(limit=page * 2 + 3)], expected[-(page * 2 + 3):])):
+                    if sorted(ids) != want or not tumblr.response_is_ok():
+                        failures.append("%s prefetch=%s %s: %d posts (%d unique) of %d %s" % (cursor, prefetch, name, len(ids),
+                                        len(set(ids)), len(want), tumblr.last_error() or ''))
+    finally:
+        mock.stop()
+    return failures
+
+
+def report(results):
+    """ print results table """
+    ms = lambda sec: "%8.1f" % (sec * 1000) if sec is not None else "%8s" % '-'
+    print("%-8s %7s %6s %8s %10s %10s %7s %8s %8s" % ('path', 'uploads', 'errors', 'seconds', 'uploads/s', 'calls/up', 'retries', 'p50 ms', 'p99 ms'))
+    for res in results:
+        print("%-8s %7d %6d %8.2f %10.2f %10s %7s %s %s" % (res['path'], res['uploads'], res['errors'], res['seconds'],
+                                                            res['uploads_per_sec'] or 0, res['calls_per_upload'], res['retries'],
+                                                            ms(res['upload_p50']), ms(res['upload_p99'])))
+        for labels in sorted(res['rq_p50']):
+            print("    request %-24s p50 %s ms  p99 %s ms" % (labels, ms(res['rq_p50'][labels]), ms(res['rq_p99'][labels])))
+
+
+if __name__ == '__main__':
+    if tumblrmock.option('check-paging', False):
+        failures = check_paging()
+        print("\n".join(["FAIL: %s" % failure for failure in failures]) or "OK: paging")
+        sys.exit(1 if failures else 0)
+    n, videos = tumblrmock.option('n', 50), tumblrmock.option('videos', 0)
+    workers, poll = tumblrmock.option('workers', 8), tumblrmock.option('poll', 'fixed')
+    mock = tumblrmock.MockTumblr(latency=tumblrmock.option('latency', 0.05), jitter=tumblrmock.option('jitter', 0.01),
+                                 photo_delay=tumblrmock.option('photo-delay', 0.5), video_delay=tumblrmock.option('video-delay', 2.0),
+                                 error_rate=tumblrmock.option('error-rate', 0.0),
+                                 error_status=tumblrmock.option('error-status', 503), seed=1)
+    url = mock.start()
+    tmp = tempfile.mkdtemp(prefix='tumblrbench-')
+    try:
+        results = []
+        for bench in (bench_library, bench_cli):
+            medias = make_media(os.path.join(tmp, bench.__name__), n - videos, videos)
+            results.append(bench(url, medias, tmp, poll, workers))
+        if tumblrmock.option('json', False):
+            print(json.dumps(results, indent=4))
+        else:
+            report(results)
+    finally:
+        mock.stop()
+        shutil.rmtree(tmp)
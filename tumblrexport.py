@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+
+"""
+BlogExport class for offline backup (mirror) of blog - all posts as JSON lines and their original size media
+
+posts are walked page by page and written to posts.jsonl (replaced atomically when the walk completes),
+photo and video urls (the same fields as options photo_url, video_url) are downloaded as pages arrive
+by pooled concurrent downloader:
+
+    - media is streamed to disk in chunks into .part file and renamed when complete
+    - interrupted .part file is resumed by HTTP Range request (If-Range etag, so changed media starts again)
+    - media with local copy of the same size (and etag) is skipped, so nightly runs transfer only new media
+
+    export/posts.jsonl          one post per line
+    export/media/<id>-<name>    media files
+    export/export.sqlite        download state - url -> file, size, etag
+
+"""
+
+__VERSION__ = '2020.08.04'
+
+import os, json, time, sqlite3, threading, urllib.parse
+from tumblrsimple import Projection
+
+
+class BlogExport:
+    """ export posts and media of blog to directory, resumable and incremental """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS media (
+            url         TEXT PRIMARY KEY,
+            path        TEXT,
+            size        INTEGER,
+            etag        TEXT,
+            complete    INTEGER
+        );
+    """
+
+    def __init__(self, tumblr, folder, options=None):
+        """ init with TumblrSimple instance, export directory and options (export_* keys of tumblr options by default) """
+        options = tumblr.options if options is None else options
+        self.tumblr = tumblr
+        self.folder = folder
+        self.media_dir = os.path.join(folder, "media")
+        self.workers = options.get("export_workers", options.get("batch_workers", 4))
+        # download chunk size - multi GB videos are never loaded into memory
+        self.chunk = options.get("export_chunk", 1 << 20)
+        self.timeout = options.get("export_timeout", 60)
+        # check completed media with server (HEAD size/etag) instead of trusting download state
+        self.verify = options.get("export_verify", False)
+        self.photo_url = Projection.post_xpath(options.get("photo_url", "/posts[0]/photos[0]/original_size/url"))
+        self.video_url = Projection.post_xpath(options.get("video_url", "/posts[0]/video_url"))
+        self.db, self.session = None, None
+        self.lock = threading.Lock()
+        # number of exported posts
+        self.posts = 0
+
+    def open(self):
+        """ create export directory, open download state db and pooled http session """
+        import requests
+        os.makedirs(self.media_dir, exist_ok=True)
+        # connection is shared by worker threads
+        self.db = sqlite3.connect(os.path.join(self.folder, "export.sqlite"), check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript(self.schema)
+        self.session = requests.Session()
+        # media may be spread over few hosts, keep-alive connections for all workers
+        adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=self.workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # bytes on disk must match Content-Length and Range offsets
+        self.session.headers['Accept-Encoding'] = 'identity'
+
+    def close(self):
+        if self.session: self.session.close()
+        if self.db: self.db.close()
+        self.db, self.session = None, None
+
+    # download state
+
+    def state(self, url):
+        """ download state dict (path, size, etag, complete) of url or None """
+        with self.lock:
+            row = self.db.execute("SELECT path, size, etag, complete FROM media WHERE url=?", (url,)).fetchone()
+        return dict(zip(('path', 'size', 'etag', 'complete'), row)) if row else None
+
+    def set_state(self, url, path, size, etag, complete):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO media (url, path, size, etag, complete) VALUES (?,?,?,?,?)",
+                            (url, path, size, etag, int(complete)))
+
+    # media
+
+    def media_urls(self, post):
+        """ original size photo (all photos of photoset) and video urls of post """
+        xpaths = [self.photo_url, self.video_url]
+        if '/photos[0]/' in self.photo_url:
+            xpaths = [self.photo_url.replace('/photos[0]/', '/photos[%d]/' % i) for i in range(len(post.get("photos") or []))] + [self.video_url]
+        urls = []
+        for xpath in xpaths:
+            try:
+                url = Projection.get_xpath(post, xpath)
+            except (KeyError, IndexError, TypeError):
+                continue
+            if isinstance(url, str) and url.startswith(('http://', 'https://')) and url not in urls:
+                urls.append(url)
+        return urls
+
+    def media_path(self, post, url):
+        """ local file of media url - post id prefix keeps names unique """
+        name = os.path.basename(urllib.parse.urlparse(url).path) or "media"
+        return os.path.join(self.media_dir, "%s-%s" % (post["id"], name))
+
+    def download(self, url, path):
+        """ download url to path, return (status, bytes transferred) - status is downloaded, resumed or skipped,
+            raise IOError (requests.RequestException) on failure - .part file is kept for resume
+        """
+        part = path + '.part'
+        state = self.state(url)
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            if state and state['complete'] and state['size'] == size and not self.verify:
+                return 'skipped', 0
+            # local copy unknown to state (or verify) - compare size and etag with server
+            head = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+            etag = head.headers.get('ETag')
+            if head.ok and head.headers.get('Content-Length') == "%d" % size and (not state or not etag or state['etag'] in (None, etag)):
+                self.set_state(url, path, size, etag, True)
+                return 'skipped', 0
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers, mode = {}, 'wb'
+        # resume only the same media version (If-Range etag), otherwise server sends entire media again
+        if offset and state and state['etag']:
+            # complete .part not renamed yet
+            if offset == state['size']:
+                os.replace(part, path)
+                self.set_state(url, path, offset, state['etag'], True)
+                return 'resumed', 0
+            headers = {'Range': 'bytes=%d-' % offset, 'If-Range': state['etag']}
+        sent = 0
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 206 and resp.headers.get('Content-Range', '').startswith('bytes %d-' % offset):
+                mode = 'ab'
+            elif resp.status_code != 200:
+                # stale .part (range not satisfiable) is dropped, so the next try starts again
+                if resp.status_code == 416 and os.path.exists(part):
+                    os.remove(part)
+                raise IOError("HTTP %s %s" % (resp.status_code, resp.reason))
+            else:
+                offset = 0
+            etag = resp.headers.get('ETag')
+            length = resp.headers.get('Content-Length')
+            total = offset + int(length) if length and length.isdigit() else None
+            # etag of .part for resume after crash
+            self.set_state(url, path, total, etag, False)
+            with open(part, mode) as f:
+                for data in resp.iter_content(self.chunk):
+                    f.write(data)
+                    sent += len(data)
+                    self.tumblr.metrics.inc('export_bytes_total', len(data))
+        size = os.path.getsize(part)
+        if total is not None and size != total:
+            raise IOError("incomplete download %d/%d bytes" % (size, total))
+        os.replace(part, path)
+        self.set_state(url, path, size, etag, True)
+        return 'resumed' if mode == 'ab' else 'downloaded', sent
+
+    def fetch(self, post, url):
+        """ download media url of post with retries (options retry_*) resuming from .part file, return result dict """
+        import requests
+        path = self.media_path(post, url)
+        retry = self.tumblr.retry
+        attempts = retry.attempts if retry else 1
+        result = {'id': post["id"], 'url': url, 'path': path, 'status': None, 'bytes': 0, 'error': None}
+        for attempt in range(attempts):
+            try:
+                with self.tumblr.metrics.timer('export_seconds'):
+                    result['status'], sent = self.download(url, path)
+                result['bytes'] += sent
+                result['error'] = None
+                break
+            except (IOError, requests.RequestException) as e:
+                result['error'] = "ERROR: %s - %s" % (type(e).__name__, e)
+                if attempt + 1 < attempts:
+                    time.sleep(retry.delay(attempt))
+        self.tumblr.metrics.inc('export_media_total', status=result['status'] or 'error')
+        return result
+
+    def run(self, limit=None):
+        """ export max limit posts (default all) and download their media concurrently, yield media result dicts
+            as downloads finish, posts.jsonl is replaced only if the walk over posts completes
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+        self.open()
+        posts_file = os.path.join(self.folder, "posts.jsonl")
+        tmp = posts_file + '.%s.tmp' % os.getpid()
+        self.posts = 0
+        try:
+            running = set()
+            with open(tmp, "w") as out, ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for post in self.tumblr.iter_posts(limit=limit):
+                    out.write(json.dumps(post, sort_keys=True) + "\n")
+                    self.posts += 1
+                    for url in self.media_urls(post):
+                        # bounded queue - walk over posts waits for slow downloads
+                        if len(running) >= self.workers * 4:
+                            done, running = wait(running, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                yield future.result()
+                        running.add(pool.submit(self.fetch, post, url))
+                for future in as_completed(running):
+                    yield future.result()
+            if self.tumblr.response_is_ok():
+                os.replace(tmp, posts_file)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self.close()
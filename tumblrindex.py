@@ -0,0 +1,369 @@
+#!/usr/bin/python3
+
+"""
+TumblrIndex class for local SQLite index of blog posts
+
+index keeps post id -> tags, state, type, timestamp and media urls,
+tag lookups use real sql index so they stay fast for blogs with 100k+ posts
+
+UploadManifest class for persistent manifest of uploaded media keyed by content hash
+
+UploadJournal class for crash-safe append-only journal of upload phases (resume of interrupted uploads)
+
+"""
+
+__VERSION__ = '2020.08.04'
+
+import os, copy, json, time, sqlite3, threading, hashlib
+
+
+class TumblrIndex:
+    """ local SQLite index of blog posts """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS posts (
+            id          INTEGER PRIMARY KEY,
+            type        TEXT,
+            state       TEXT,
+            timestamp   INTEGER,
+            tags        TEXT,
+            urls        TEXT
+        );
+        CREATE INDEX IF NOT EXISTS posts_timestamp ON posts(timestamp);
+        CREATE TABLE IF NOT EXISTS tags (
+            tag         TEXT,
+            id          INTEGER,
+            PRIMARY KEY (tag, id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS tags_id ON tags(id);
+        CREATE TABLE IF NOT EXISTS meta (
+            key         TEXT PRIMARY KEY,
+            value       TEXT
+        );
+    """
+
+    def __init__(self, filename):
+        """ open (create) index db filename """
+        self.filename = filename
+        # connection is shared by worker threads
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.executescript(self.schema)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def post_urls(post):
+        """ get media urls from post - original size photos and video """
+        urls = {}
+        photos = [photo["original_size"]["url"] for photo in post.get("photos", []) if photo.get("original_size")]
+        if photos: urls["photos"] = photos
+        if post.get("video_url"): urls["video"] = post["video_url"]
+        return urls
+
+    def _put(self, post):
+        """ insert or replace single post - no locking/commit """
+        id, tags = int(post["id"]), post.get("tags", [])
+        self.db.execute("INSERT OR REPLACE INTO posts (id, type, state, timestamp, tags, urls) VALUES (?,?,?,?,?,?)",
+                        (id, post.get("type"), post.get("state"), post.get("timestamp"),
+                         json.dumps(tags), json.dumps(self.post_urls(post))))
+        self.db.execute("DELETE FROM tags WHERE id=?", (id,))
+        self.db.executemany("INSERT OR IGNORE INTO tags (tag, id) VALUES (?,?)", [(tag, id) for tag in tags])
+
+    def put(self, posts):
+        """ insert or replace list of posts in one transaction """
+        with self.lock, self.db:
+            for post in posts:
+                self._put(post)
+
+    def delete(self, ids):
+        """ delete list of post ids """
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM posts WHERE id=?", [(int(id),) for id in ids])
+            self.db.executemany("DELETE FROM tags WHERE id=?", [(int(id),) for id in ids])
+
+    def keep(self, ids):
+        """ delete all posts not in set of ids (posts deleted on the server), return number of deleted posts """
+        with self.lock:
+            gone = [id for id, in self.db.execute("SELECT id FROM posts") if id not in ids]
+        self.delete(gone)
+        return len(gone)
+
+    def get(self, id):
+        """ get post dict (id, type, state, timestamp, tags, urls) for id or None if not indexed """
+        with self.lock:
+            row = self.db.execute("SELECT id, type, state, timestamp, tags, urls FROM posts WHERE id=?", (int(id),)).fetchone()
+        if not row: return None
+        return self.row_post(row)
+
+    def get_tags(self, id):
+        """ get list of tags for id or None if not indexed """
+        with self.lock:
+            row = self.db.execute("SELECT tags FROM posts WHERE id=?", (int(id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_tags(self, id, tags):
+        """ update tags of indexed post id """
+        with self.lock, self.db:
+            self.db.execute("UPDATE posts SET tags=? WHERE id=?", (json.dumps(tags), int(id)))
+            self.db.execute("DELETE FROM tags WHERE id=?", (int(id),))
+            self.db.executemany("INSERT OR IGNORE INTO tags (tag, id) VALUES (?,?)", [(tag, int(id)) for tag in tags])
+
+    def find_tag(self, tag, limit=None):
+        """ get list of post ids tagged with tag, the newest first """
+        with self.lock:
+            rows = self.db.execute("SELECT posts.id FROM tags JOIN posts ON posts.id = tags.id WHERE tags.tag=? "
+                                   "ORDER BY posts.timestamp DESC LIMIT ?", (tag, -1 if limit is None else limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_tags(self, limit=None):
+        """ generate (id, [tags]) for all indexed posts, the newest first """
+        for post in self.iter_posts(limit=limit):
+            yield post['id'], post['tags']
+
+    def iter_posts(self, tag=None, limit=None, batch=1000):
+        """ generate post dicts (as get) of all indexed posts (optionally tagged with tag), the newest first,
+            read in batches (keyset paging), so memory does not depend on index size
+        """
+        cond = "posts.id IN (SELECT id FROM tags WHERE tag=?)" if tag else "1"
+        last, left = None, -1 if limit is None else limit
+        while left:
+            page = batch if left < 0 else min(batch, left)
+            with self.lock:
+                if last is None:
+                    rows = self.db.execute("SELECT id, type, state, timestamp, tags, urls FROM posts WHERE %s "
+                                           "ORDER BY timestamp DESC, id DESC LIMIT ?" % cond, ([tag] if tag else []) + [page]).fetchall()
+                else:
+                    rows = self.db.execute("SELECT id, type, state, timestamp, tags, urls FROM posts WHERE %s "
+                                           "AND (timestamp < ? OR (timestamp = ? AND id < ?)) "
+                                           "ORDER BY timestamp DESC, id DESC LIMIT ?" % cond,
+                                           ([tag] if tag else []) + [last[0], last[0], last[1], page]).fetchall()
+            for row in rows:
+                yield self.row_post(row)
+            if len(rows) < page:
+                break
+            last, left = (rows[-1][3], rows[-1][0]), left - len(rows) if left > 0 else left
+
+    @staticmethod
+    def row_post(row):
+        """ post dict from row (id, type, state, timestamp, tags, urls) """
+        return {
+            'id':           row[0],
+            'type':         row[1],
+            'state':        row[2],
+            'timestamp':    row[3],
+            'tags':         json.loads(row[4]),
+            'urls':         json.loads(row[5])
+        }
+
+    @staticmethod
+    def as_post(post):
+        """ indexed post dict -> api-like post (photos/video_url instead of urls) for projections """
+        post = dict(post)
+        urls = post.pop('urls', {})
+        if urls.get('photos'):
+            post['photos'] = [{'original_size': {'url': url}} for url in urls['photos']]
+        if urls.get('video'):
+            post['video_url'] = urls['video']
+        return post
+
+    def set_synced(self, stamp):
+        """ store time of the last sync """
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced', ?)", (str(stamp),))
+
+    def synced(self):
+        """ time of the last sync, None if never synced (index can not be used for listings) """
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key='synced'").fetchone()
+        return float(row[0]) if row else None
+
+    def count(self):
+        """ number of indexed posts """
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+
+class UploadManifest:
+    """ persistent manifest of uploaded media - content hash -> post id/url
+
+        content hash is cached per (path, size, mtime) so unchanged files are not hashed again,
+        uploads to other blogs (fan-out) are kept by blog name in the same db (for_blog())
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS media (
+            path        TEXT PRIMARY KEY,
+            size        INTEGER,
+            mtime       REAL,
+            sha256      TEXT
+        );
+        CREATE TABLE IF NOT EXISTS uploads (
+            sha256      TEXT PRIMARY KEY,
+            path        TEXT,
+            id          INTEGER,
+            url         TEXT
+        );
+        CREATE TABLE IF NOT EXISTS blog_uploads (
+            blog        TEXT,
+            sha256      TEXT,
+            path        TEXT,
+            id          INTEGER,
+            url         TEXT,
+            PRIMARY KEY (blog, sha256)
+        );
+    """
+
+    # hashing chunk size - multi GB videos are never loaded into memory
+    chunk = 1 << 20
+
+    def __init__(self, filename):
+        """ open (create) manifest db filename """
+        self.filename = filename
+        # connection is shared by worker threads
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.executescript(self.schema)
+        # uploads of other blog, None for the main blog
+        self.blog = None
+
+    def close(self):
+        self.db.close()
+
+    def for_blog(self, blog):
+        """ manifest of uploads to other blog - shares db and content hash cache with this one """
+        twin = copy.copy(self)
+        twin.blog = blog
+        return twin
+
+    @classmethod
+    def file_hash(cls, path):
+        """ sha256 hex digest of file content streamed in chunks """
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for data in iter(lambda: f.read(cls.chunk), b''):
+                sha.update(data)
+        return sha.hexdigest()
+
+    def media_hash(self, path):
+        """ content hash of media - cached for unchanged size and mtime """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self.lock:
+            row = self.db.execute("SELECT sha256 FROM media WHERE path=? AND size=? AND mtime=?", (path, st.st_size, st.st_mtime)).fetchone()
+        if row:
+            return row[0]
+        sha = self.file_hash(path)
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO media (path, size, mtime, sha256) VALUES (?,?,?,?)", (path, st.st_size, st.st_mtime, sha))
+        return sha
+
+    def lookup(self, path):
+        """ get (content hash, id/url dict or None if not uploaded yet) for media path """
+        sha = self.media_hash(path)
+        with self.lock:
+            if self.blog is None:
+                row = self.db.execute("SELECT id, url FROM uploads WHERE sha256=?", (sha,)).fetchone()
+            else:
+                row = self.db.execute("SELECT id, url FROM blog_uploads WHERE blog=? AND sha256=?", (self.blog, sha)).fetchone()
+        return sha, {'id': row[0], 'url': row[1]} if row else None
+
+    def record(self, sha, path, id, url):
+        """ record uploaded media content hash -> post id/url """
+        with self.lock, self.db:
+            if self.blog is None:
+                self.db.execute("INSERT OR REPLACE INTO uploads (sha256, path, id, url) VALUES (?,?,?,?)",
+                                (sha, os.path.abspath(path), int(id), url))
+            else:
+                self.db.execute("INSERT OR REPLACE INTO blog_uploads (blog, sha256, path, id, url) VALUES (?,?,?,?,?)",
+                                (self.blog, sha, os.path.abspath(path), int(id), url))
+
+    def forget(self, ids):
+        """ remove uploads of deleted post ids """
+        with self.lock, self.db:
+            if self.blog is None:
+                self.db.executemany("DELETE FROM uploads WHERE id=?", [(int(id),) for id in ids])
+            else:
+                self.db.executemany("DELETE FROM blog_uploads WHERE blog=? AND id=?", [(self.blog, int(id)) for id in ids])
+
+
+class UploadJournal:
+    """ crash-safe append-only journal of upload phases - JSON line per phase change, fsync'ed before upload continues
+
+        queued -> uploaded (created post id) -> processing -> published (id/url) -> uid-tag-removed (videos found by uid tag)
+        or failed (upload request failed, no post created), entry is merged from all its lines
+    """
+
+    # the last phase of finished entry by upload mode
+    final = {'photo': 'published', 'video-stable': 'published', 'video': 'uid-tag-removed'}
+
+    def __init__(self, filename, sync=True):
+        """ open (create) journal filename, fsync every record if sync """
+        self.filename = filename
+        self.sync = sync
+        self.lock = threading.Lock()
+        # key -> merged entry
+        self.entries = self.load()
+        self.fd = self.open()
+
+    def open(self):
+        """ open for append, terminate torn last line of crashed write """
+        fd = os.open(self.filename, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        size = os.fstat(fd).st_size
+        if size and os.pread(fd, 1, size - 1) != b"\n":
+            os.write(fd, b"\n")
+        return fd
+
+    def close(self):
+        os.close(self.fd)
+
+    def load(self):
+        """ merged entries from journal file (torn lines skipped) """
+        entries = {}
+        try:
+            with open(self.filename, "r") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries.setdefault(rec["key"], {}).update(rec)
+        except IOError:
+            pass
+        return entries
+
+    def record(self, key, phase, **fields):
+        """ append phase and fields of entry key (new entry for None) durably, return key """
+        with self.lock:
+            key = key or os.urandom(8).hex()
+            rec = dict(fields, key=key, phase=phase, time=round(time.time(), 3))
+            os.write(self.fd, (json.dumps(rec) + "\n").encode("utf-8"))
+            if self.sync:
+                os.fsync(self.fd)
+            self.entries.setdefault(key, {}).update(rec)
+        return key
+
+    def finished(self, entry):
+        return entry["phase"] in ("failed", self.final.get(entry.get("mode")))
+
+    def unfinished(self):
+        """ list of unfinished entries, the oldest first """
+        with self.lock:
+            return [dict(entry) for entry in self.entries.values() if not self.finished(entry)]
+
+    def compact(self):
+        """ rewrite journal with unfinished entries only (one merged line per entry, atomic replace) """
+        with self.lock:
+            self.entries = dict([(key, entry) for key, entry in self.entries.items() if not self.finished(entry)])
+            tmp = self.filename + ".tmp"
+            with open(tmp, "w") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.filename)
+            os.close(self.fd)
+            self.fd = self.open()
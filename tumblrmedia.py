@@ -0,0 +1,402 @@
+#!/usr/bin/python3
+
+"""
+MediaPrep class for optional local preprocessing of media before upload
+
+photos are resized to max dimension and recompressed (Pillow) in process pool across all cores,
+videos are probed (ffprobe) and transcoded (ffmpeg) to H.264/AAC mp4 if codec, pixel format or size would
+make tumblr transcode them again (long server processing), in worker pool overlapped with other uploads,
+results are written to cache directory keyed by source file (realpath, size, mtime_ns) and settings, so re-runs do not
+redo the work (nor read the source)
+
+MediaMeta class for cached media metadata - capture time, camera and GPS from EXIF (jpeg) and mvhd/udta (mp4/mov)
+headers, only header bytes are read, directories are scanned in parallel and results persisted in SQLite
+keyed by (realpath, size, mtime_ns)
+
+preprocessed copy is used only as upload data - original file still drives gmt_media, filename tags and manifest
+
+"""
+
+__VERSION__ = '2020.08.04'
+
+import os, json, threading, subprocess, sqlite3, struct, datetime, re, hashlib
+
+
+def source_key(path):
+    """ cache key of source media by (realpath, size, mtime_ns) - cache hit does not read the file, changed file gets new key """
+    st = os.stat(path)
+    return hashlib.sha256(("%s\0%d\0%d" % (os.path.realpath(path), st.st_size, st.st_mtime_ns)).encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def prepare_photo(path, cache_dir, fmt, max_dim, quality, exif):
+    """ resize photo to max_dim and recompress in format fmt (runs in worker process),
+        return path of cached copy or original path if Pillow is missing or nothing is gained
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return path
+    ext = os.path.splitext(path)[1].lower()
+    out = os.path.join(cache_dir, "%s-%s-q%s-%s%s" % (source_key(path), max_dim, quality, 'exif' if exif else 'noexif', ext))
+    # cached copy, or marker of original not worth processing
+    if os.path.exists(out):
+        return out
+    if os.path.exists(out + '.orig'):
+        return path
+    try:
+        with Image.open(path) as img:
+            exifdata = img.getexif()
+            # pixels in display orientation - orientation tag is reset below
+            img = ImageOps.exif_transpose(img)
+            resized = max(img.size) > max_dim
+            if resized:
+                img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+            params = {'optimize': True}
+            if fmt in ('JPEG', 'WEBP'):
+                params['quality'] = quality
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+            if exif and exifdata:
+                exifdata[0x0112] = 1
+                params['exif'] = exifdata.tobytes()
+            tmp = out + '.%s.tmp' % os.getpid()
+            img.save(tmp, fmt, **params)
+    except (IOError, ValueError, SyntaxError):
+        # not decodable by Pillow - upload original
+        return path
+    # keep original if recompression did not help
+    if not resized and os.path.getsize(tmp) >= os.path.getsize(path):
+        os.remove(tmp)
+        open(out + '.orig', 'w').close()
+        return path
+    os.replace(tmp, out)
+    return out
+
+
+def probe_video(path):
+    """ ffprobe streams and format of video as dict, None if ffprobe is missing or fails """
+    try:
+        out = subprocess.run(['ffprobe', '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', path],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        return json.loads(out.decode('utf-8'))
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+def video_needs_transcode(info, max_dim):
+    """ True if probed video is not tumblr friendly - H.264 yuv420p video, AAC (or no) audio, mp4/mov, max dimension """
+    streams = info.get("streams", [])
+    video = [st for st in streams if st.get("codec_type") == "video"]
+    audio = [st for st in streams if st.get("codec_type") == "audio"]
+    if not video or video[0].get("codec_name") != "h264" or video[0].get("pix_fmt") != "yuv420p":
+        return True
+    if max(video[0].get("width", 0), video[0].get("height", 0)) > max_dim:
+        return True
+    if audio and audio[0].get("codec_name") != "aac":
+        return True
+    return "mp4" not in info.get("format", {}).get("format_name", "")
+
+
+def prepare_video(path, cache_dir, max_dim, crf, preset):
+    """ transcode video to H.264/AAC mp4 with max_dim if needed (runs in worker thread, ffmpeg is separate process),
+        return path of cached copy or original path if ffmpeg is missing, fails or video is already fine
+    """
+    out = os.path.join(cache_dir, "%s-%s-crf%s-%s.mp4" % (source_key(path), max_dim, crf, preset))
+    # cached copy, or marker of original not worth processing
+    if os.path.exists(out):
+        return out
+    if os.path.exists(out + '.orig'):
+        return path
+    info = probe_video(path)
+    if info is None:
+        return path
+    if not video_needs_transcode(info, max_dim):
+        open(out + '.orig', 'w').close()
+        return path
+    tmp = out + '.%s.tmp.mp4' % threading.get_ident()
+    # scale down longer side to max_dim keeping aspect ratio (even dimensions for yuv420p)
+    scale = "scale='if(gte(iw,ih),min(iw,%d),-2)':'if(gte(iw,ih),-2,min(ih,%d))'" % (max_dim, max_dim)
+    try:
+        subprocess.run(['ffmpeg', '-nostdin', '-y', '-v', 'error', '-i', path, '-map', '0:v:0', '-map', '0:a:0?',
+                        '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p', '-vf', scale,
+                        '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart', tmp],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        if os.path.exists(tmp): os.remove(tmp)
+        return path
+    os.replace(tmp, out)
+    return out
+
+
+def exif_meta(path, head=1 << 18):
+    """ capture time (DateTimeOriginal), camera (Make Model) and GPS (lat, lon) from jpeg EXIF in first head bytes """
+    with open(path, "rb") as f:
+        buf = f.read(head)
+    if buf[:2] != b'\xff\xd8':
+        return {}
+    # find APP1 Exif segment
+    pos, tiff = 2, None
+    while pos + 4 <= len(buf) and buf[pos] == 0xff:
+        marker, size = buf[pos + 1], struct.unpack('>H', buf[pos + 2:pos + 4])[0]
+        if marker == 0xe1 and buf[pos + 4:pos + 10] == b'Exif\0\0':
+            tiff = buf[pos + 10:pos + 2 + size]
+            break
+        # start of scan - no more metadata
+        if marker == 0xda:
+            break
+        pos += 2 + size
+    if not tiff or tiff[:2] not in (b'II', b'MM'):
+        return {}
+    order = '<' if tiff[:2] == b'II' else '>'
+    # type -> (struct format, size)
+    types = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 7: ('B', 1), 9: ('i', 4), 10: ('ii', 8)}
+
+    def ifd(offset):
+        """ tag -> value for IFD at offset """
+        tags = {}
+        if offset + 2 > len(tiff):
+            return tags
+        for i in range(struct.unpack(order + 'H', tiff[offset:offset + 2])[0]):
+            entry = offset + 2 + i * 12
+            if entry + 12 > len(tiff):
+                break
+            tag, typ, cnt = struct.unpack(order + 'HHI', tiff[entry:entry + 8])
+            if typ not in types:
+                continue
+            fmt, size = types[typ]
+            at = entry + 8 if size * cnt <= 4 else struct.unpack(order + 'I', tiff[entry + 8:entry + 12])[0]
+            data = tiff[at:at + size * cnt]
+            if len(data) < size * cnt:
+                continue
+            if typ == 2:
+                tags[tag] = data.split(b'\0')[0].decode('utf-8', 'replace').strip()
+            elif typ in (5, 10):
+                vals = struct.unpack(order + fmt[0] * 2 * cnt, data)
+                tags[tag] = [vals[i] / vals[i + 1] if vals[i + 1] else 0 for i in range(0, len(vals), 2)]
+            else:
+                tags[tag] = list(struct.unpack(order + fmt * cnt, data))
+        return tags
+
+    ifd0 = ifd(struct.unpack(order + 'I', tiff[4:8])[0])
+    exif = ifd(ifd0[0x8769][0]) if 0x8769 in ifd0 else {}
+    gps = ifd(ifd0[0x8825][0]) if 0x8825 in ifd0 else {}
+    meta = {}
+    # "2017:07:21 13:43:12" -> isoformat
+    m = re.match(r'(\d{4}):(\d\d):(\d\d) (\d\d):(\d\d):(\d\d)', exif.get(0x9003) or ifd0.get(0x0132) or '')
+    if m and m.group(1) != '0000':
+        meta['time'] = "%s-%s-%sT%s:%s:%s" % m.groups()
+    camera = ' '.join([v for v in (ifd0.get(0x010f), ifd0.get(0x0110)) if isinstance(v, str) and v])
+    if camera:
+        meta['camera'] = camera
+    if isinstance(gps.get(2), list) and isinstance(gps.get(4), list) and len(gps[2]) == 3 and len(gps[4]) == 3:
+        lat = gps[2][0] + gps[2][1] / 60 + gps[2][2] / 3600
+        lon = gps[4][0] + gps[4][1] / 60 + gps[4][2] / 3600
+        meta['gps'] = [round(-lat if gps.get(1) == 'S' else lat, 5), round(-lon if gps.get(3) == 'W' else lon, 5)]
+    return meta
+
+
+def mp4_meta(path):
+    """ capture time (moov/mvhd creation time, UTC), camera (udta ©mak ©mod) and GPS (udta ©xyz) from mp4/mov,
+        only box headers and moov are read - mdat is skipped by seeking
+    """
+    meta = {}
+    with open(path, "rb") as f:
+        end = os.fstat(f.fileno()).st_size
+
+        def boxes(start, stop):
+            """ generate (type, payload offset, payload size) of boxes in range """
+            pos = start
+            while pos + 8 <= stop:
+                f.seek(pos)
+                size, typ = struct.unpack('>I4s', f.read(8))
+                hdr = 8
+                if size == 1:
+                    size, hdr = struct.unpack('>Q', f.read(8))[0], 16
+                elif size == 0:
+                    size = stop - pos
+                if size < hdr:
+                    return
+                yield typ, pos + hdr, size - hdr
+                pos += size
+
+        for typ, pos, size in boxes(0, end):
+            if typ != b'moov':
+                continue
+            for typ, pos, size in boxes(pos, pos + size):
+                if typ == b'mvhd':
+                    f.seek(pos)
+                    data = f.read(12)
+                    stamp = struct.unpack('>Q', data[4:12])[0] if data[0] == 1 else struct.unpack('>I', data[4:8])[0]
+                    # seconds since 1904-01-01 UTC, 0 = unknown
+                    if stamp > 0:
+                        t = datetime.datetime(1904, 1, 1) + datetime.timedelta(seconds=stamp)
+                        if t.year > 1970: meta['time'] = t.replace(microsecond=0).isoformat()
+                elif typ == b'udta':
+                    udta = {}
+                    for typ, pos, size in boxes(pos, pos + size):
+                        if typ in (b'\xa9mak', b'\xa9mod', b'\xa9xyz') and size < 1024:
+                            f.seek(pos)
+                            data = f.read(size)
+                            # 16 bit length, 16 bit language, string
+                            udta[typ] = data[4:4 + struct.unpack('>H', data[:2])[0]].decode('utf-8', 'replace').strip()
+                    camera = ' '.join([udta[k] for k in (b'\xa9mak', b'\xa9mod') if udta.get(k)])
+                    if camera: meta['camera'] = camera
+                    # ISO 6709 "+50.0800+014.4200/"
+                    m = re.match(r'([+-]\d+(?:\.\d+)?)([+-]\d+(?:\.\d+)?)', udta.get(b'\xa9xyz', ''))
+                    if m: meta['gps'] = [round(float(m.group(1)), 5), round(float(m.group(2)), 5)]
+            break
+    return meta
+
+
+def scan_meta(path):
+    """ metadata dict of media path (time, camera, gps - all optional), {} if unknown format or broken headers """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext in ('.jpg', '.jpeg'):
+            return exif_meta(path)
+        if ext in ('.mp4', '.mov', '.m4v', '.3gp'):
+            return mp4_meta(path)
+    except (IOError, struct.error, IndexError, OverflowError):
+        pass
+    return {}
+
+
+class MediaMeta:
+    """ persistent cache of media metadata keyed by (realpath, size, mtime_ns) - only header bytes are read on miss """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS media (
+            path        TEXT PRIMARY KEY,
+            size        INTEGER,
+            mtime_ns    INTEGER,
+            meta        TEXT
+        );
+    """
+
+    def __init__(self, filename, workers=8):
+        """ open (create) metadata db filename, scan with workers threads """
+        self.filename = filename
+        self.workers = workers
+        # connection is shared by worker threads
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.executescript(self.schema)
+
+    def close(self):
+        self.db.close()
+
+    def cached(self, path, st):
+        """ cached metadata for path with stat st or None """
+        with self.lock:
+            row = self.db.execute("SELECT meta FROM media WHERE path=? AND size=? AND mtime_ns=?", (path, st.st_size, st.st_mtime_ns)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, path):
+        """ metadata of media path - cached or scanned and stored """
+        return self.scan([path])[path]
+
+    def scan(self, paths):
+        """ metadata of list of media paths - uncached ones scanned in parallel and stored in one transaction,
+            return dict path -> metadata
+        """
+        result, todo = {}, []
+        for path in paths:
+            st = os.stat(path)
+            meta = self.cached(os.path.realpath(path), st)
+            if meta is None:
+                todo.append((path, st))
+            else:
+                result[path] = meta
+        if not todo:
+            return result
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            metas = list(pool.map(scan_meta, [path for path, st in todo]))
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO media (path, size, mtime_ns, meta) VALUES (?,?,?,?)",
+                                [(os.path.realpath(path), st.st_size, st.st_mtime_ns, json.dumps(meta)) for (path, st), meta in zip(todo, metas)])
+        result.update(zip([path for path, st in todo], metas))
+        return result
+
+
+class MediaPrep:
+    """ preprocess media in process pool before upload, prepared copies cached by source file and settings """
+
+    # processed photo formats by extension - gif (animations) and others are uploaded as they are
+    photo_formats = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+
+    def __init__(self, options, cache_dir, video_ext=()):
+        """ init with options photo_max_dim, photo_quality, photo_exif, prep_workers, video_transcode, video_max_dim,
+            video_crf, video_preset, transcode_workers, cache directory and video extensions
+        """
+        self.max_dim = options.get("photo_max_dim", 0)
+        self.quality = options.get("photo_quality", 85)
+        self.exif = options.get("photo_exif", True)
+        self.workers = options.get("prep_workers") or os.cpu_count()
+        self.video_ext = video_ext if options.get("video_transcode") else ()
+        self.video_max_dim = options.get("video_max_dim", 1920)
+        self.video_crf = options.get("video_crf", 23)
+        self.video_preset = options.get("video_preset", "veryfast")
+        # ffmpeg uses all cores itself, so only few concurrent transcodes
+        self.video_workers = options.get("transcode_workers", 2)
+        self.cache_dir = cache_dir
+        # pools are started on first submit, shared by tumblr clones
+        self.pool = None
+        self.video_pool = None
+        self.lock = threading.Lock()
+        # media path -> future of prepared path
+        self.futures = {}
+
+    def kind(self, path):
+        """ 'photo' or 'video' if media path is preprocessed, None if it is uploaded as it is """
+        ext = os.path.splitext(path)[1].lower()
+        if self.max_dim and ext in self.photo_formats: return 'photo'
+        if ext in self.video_ext: return 'video'
+        return None
+
+    def enabled(self, path):
+        """ True if media path is preprocessed """
+        return self.kind(path) is not None
+
+    def task(self, path):
+        """ (fnc, args) preparing media path """
+        if self.kind(path) == 'video':
+            return prepare_video, (path, self.cache_dir, self.video_max_dim, self.video_crf, self.video_preset)
+        ext = os.path.splitext(path)[1].lower()
+        return prepare_photo, (path, self.cache_dir, self.photo_formats[ext], self.max_dim, self.quality, self.exif)
+
+    def submit(self, paths):
+        """ start preprocessing of list of media paths in photo process pool and video thread pool (in background) """
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        with self.lock:
+            for path in paths:
+                if not self.enabled(path) or path in self.futures:
+                    continue
+                fnc, args = self.task(path)
+                if fnc is prepare_video:
+                    if self.video_pool is None:
+                        self.video_pool = ThreadPoolExecutor(max_workers=self.video_workers)
+                    self.futures[path] = self.video_pool.submit(fnc, *args)
+                    continue
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                self.futures[path] = self.pool.submit(fnc, *args)
+
+    def prepared(self, path):
+        """ path of prepared media - wait for submitted work or prepare in this process, original path if not enabled """
+        if not self.enabled(path):
+            return path
+        with self.lock:
+            future = self.futures.pop(path, None)
+        if future:
+            return future.result()
+        fnc, args = self.task(path)
+        return fnc(*args)
+
+    def close(self):
+        """ stop worker pools """
+        with self.lock:
+            for pool in (self.pool, self.video_pool):
+                if pool: pool.shutdown()
+            self.pool, self.video_pool = None, None
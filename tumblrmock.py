@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+
+"""
+MockTumblr class - local stand-in HTTP server for tumblr API v2 endpoints used by TumblrSimple
+
+    GET  /v2/user/info                  blog info
+    GET  /v2/blog/{blog}/posts          posts by id, tag, limit/offset/before paging
+    POST /v2/blog/{blog}/post           create photo/video post (multipart or form)
+    POST /v2/blog/{blog}/post/edit      edit post (tags)
+    POST /v2/blog/{blog}/post/delete    delete post
+    GET  /media/{id}.jpg|mp4            media of post (ETag, Range requests)
+
+photo posts are not visible until photo_delay seconds after upload, video posts emulate transcoding:
+temporary id is visible for video_delay seconds and then replaced by the final post (or the same id
+changes state from transcoding to published with stable_id), optional latency and error injection
+
+use options api_host to point TumblrSimple to the mock server:
+
+    python3 tumblrmock.py --port=8080 --latency=0.05 --photo-delay=1 --video-delay=5 --error-rate=0.01
+
+"""
+
+__VERSION__ = '2020.08.04'
+
+import sys, json, time, random, calendar, threading, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockTumblr:
+    """ local mock tumblr API server with configurable latency, processing delays, paging and error injection """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, photo_delay=0.5, video_delay=2.0,
+                 page_limit=20, error_rate=0.0, error_status=503, stable_id=False, seed=None, media_size=64 * 1024):
+        """ init server on host:port (0 = any free port), latency +- jitter seconds per request,
+            server processing delays, max posts per page, error injection rate and status, size of served media
+        """
+        self.latency, self.jitter = latency, jitter
+        self.photo_delay, self.video_delay = photo_delay, video_delay
+        self.page_limit = page_limit
+        self.error_rate, self.error_status = error_rate, error_status
+        self.stable_id = stable_id
+        self.media_size = media_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # id -> post, visible from post['_visible'] (and until post['_until'] for temporary video ids)
+        self.posts = {}
+        self.next_id = 1000
+        # endpoint -> number of requests, bytes received
+        self.stats = {}
+        self.bytes_received = 0
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                mock.handle(self, 'GET')
+
+            def do_POST(self):
+                mock.handle(self, 'POST')
+
+            def do_HEAD(self):
+                mock.handle(self, 'HEAD')
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # listen backlog for many concurrent workers (default 5 delays connects by SYN retransmits)
+            request_queue_size = 128
+
+        self.server = Server((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """ base url for options api_host """
+        host, port = self.server.server_address[:2]
+        return "http://%s:%s" % (host, port)
+
+    def start(self):
+        """ serve in background thread, return base url """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # posts
+
+    def add_posts(self, n, tags=(), ptype='photo'):
+        """ add n published posts (newest last) for paging/listing tests, return list of ids """
+        ids = []
+        now = int(time.time())
+        with self.lock:
+            for i in range(n):
+                ids.append(self.new_post(ptype, list(tags), now - n + i, visible=0))
+        return ids
+
+    def new_post(self, ptype, tags, stamp, visible, state='published', until=None):
+        """ create post - must hold lock, return id """
+        self.next_id += 1
+        id = self.next_id
+        post = {
+            'id':           id,
+            'id_string':    str(id),
+            'type':         ptype,
+            'state':        state,
+            'timestamp':    stamp,
+            'date':         time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(stamp)),
+            'tags':         tags,
+            '_visible':     visible,
+            '_until':       until
+        }
+        if ptype == 'photo':
+            post['photos'] = [{'original_size': {'url': '%s/media/%s.jpg' % (self.url, id)}}]
+        else:
+            post['video_url'] = '%s/media/%s.mp4' % (self.url, id)
+        self.posts[id] = post
+        return id
+
+    def visible(self, post, now):
+        """ True if post is visible now - stable id video is published after transcoding """
+        if post.get('_published') and now >= post['_published']:
+            post['state'] = 'published'
+        return post['_visible'] <= now and (post['_until'] is None or now < post['_until'])
+
+    def public(self, post):
+        return dict([(key, val) for key, val in post.items() if not key.startswith('_')])
+
+    # requests
+
+    def handle(self, rq, method):
+        """ dispatch request, emulate latency and injected errors """
+        url = urllib.parse.urlparse(rq.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.strip('/').split('/')
+        # read (and count) body without keeping multipart media in memory
+        size, body = int(rq.headers.get('Content-Length') or 0), b''
+        while size > 0:
+            data = rq.rfile.read(min(size, 1 << 16))
+            if not data: break
+            size -= len(data)
+            if len(body) < 1 << 16: body += data
+        if rq.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update(urllib.parse.parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+        endpoint = "%s %s" % (method, '/'.join(['{blog}' if i == 2 and parts[:2] == ['v2', 'blog'] else p for i, p in enumerate(parts)]))
+        with self.lock:
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+            self.bytes_received += int(rq.headers.get('Content-Length') or 0)
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            fail = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            if parts[:1] == ['media']:
+                return self.send_media(rq, method, None)
+            return self.reply(rq, self.error_status, {'title': 'Injected error', 'code': 0, 'detail': 'Error injected by mock server'})
+        # malformed numeric params get error envelope, not dropped connection (retried by client as network error)
+        error = self.bad_param(params)
+        if error:
+            return self.reply(rq, *error)
+        if method in ('GET', 'HEAD') and parts[:1] == ['media'] and len(parts) == 2:
+            return self.send_media(rq, method, parts[1].split('.')[0])
+        if method == 'GET' and parts == ['v2', 'user', 'info']:
+            return self.reply(rq, 200, response={'user': {'name': 'mock', 'blogs': [{'name': 'mock'}]}})
+        if len(parts) >= 4 and parts[:2] == ['v2', 'blog']:
+            blog, action = parts[2], parts[3:]
+            if method == 'GET' and action[:1] == ['posts']:
+                return self.get_posts(rq, blog, params)
+            if method == 'POST' and action == ['post']:
+                return self.create(rq, blog, params)
+            if method == 'POST' and action == ['post', 'edit']:
+                return self.edit(rq, params)
+            if method == 'POST' and action == ['post', 'delete']:
+                return self.delete(rq, params)
+        return self.reply(rq, 404, {'title': 'Not Found', 'code': 0, 'detail': 'Post or endpoint not found'})
+
+    @staticmethod
+    def bad_param(params):
+        """ (status, error) for malformed id (not found) or before/offset/limit (bad request) param, None if all are valid """
+        for name in ('id', 'before', 'offset', 'limit'):
+            value = params.get(name)
+            try:
+                if not value or int(value) >= 0:
+                    continue
+            except ValueError:
+                pass
+            if name == 'id':
+                return 404, {'title': 'Not Found', 'code': 0, 'detail': 'Post or endpoint not found'}
+            return 400, {'title': 'Bad Request', 'code': 0, 'detail': 'Invalid %s: %s' % (name, value)}
+        return None
+
+    def reply(self, rq, status, error=None, response=None):
+        """ send tumblr style json envelope """
+        msg = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 429: 'Limit Exceeded'}.get(status, 'Error')
+        data = {'meta': {'status': status, 'msg': msg}, 'response': response if response is not None else []}
+        if error:
+            data['errors'] = [error]
+        body = json.dumps(data).encode('utf-8')
+        rq.send_response(status)
+        rq.send_header('Content-Type', 'application/json')
+        rq.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            rq.send_header('Retry-After', '1')
+        rq.end_headers()
+        rq.wfile.write(body)
+
+    def media(self, id):
+        """ deterministic media content of post id """
+        block = ("%s-" % id).encode() * 64
+        return (block * (self.media_size // len(block) + 1))[:self.media_size]
+
+    def send_media(self, rq, method, id):
+        """ media with ETag, Range (bytes=N-) and If-Range support, injected error if id is None """
+        if id is None or not id.isdigit():
+            rq.send_response(self.error_status if id is None else 404)
+            rq.send_header('Content-Length', '0')
+            rq.end_headers()
+            return
+        data, etag = self.media(id), '"%s-%d"' % (id, self.media_size)
+        status, start = 200, 0
+        rng = rq.headers.get('Range', '')
+        rng = rng[len('bytes='):].split('-')[0] if rng.startswith('bytes=') else ''
+        # malformed range is ignored - entire media
+        if rng.isdigit() and rq.headers.get('If-Range', etag) == etag:
+            start = int(rng)
+            status = 206
+        if start >= len(data) > 0:
+            rq.send_response(416)
+            rq.send_header('Content-Range', 'bytes */%d' % len(data))
+            rq.send_header('Content-Length', '0')
+            rq.end_headers()
+            return
+        rq.send_response(status)
+        rq.send_header('Content-Type', 'video/mp4' if rq.path.endswith('.mp4') else 'image/jpeg')
+        rq.send_header('Content-Length', str(len(data) - start))
+        rq.send_header('ETag', etag)
+        rq.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            rq.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+        rq.end_headers()
+        if method == 'GET':
+            rq.wfile.write(data[start:])
+
+    def get_posts(self, rq, blog, params):
+        """ posts by id or tag, newest first, limit/offset or before paging """
+        now = time.time()
+        with self.lock:
+            if params.get('id'):
+                post = self.posts.get(int(params['id']))
+                if not post or not self.visible(post, now):
+                    return self.reply(rq, 404, {'title': 'Not Found', 'code': 0, 'detail': 'Post or endpoint not found'})
+                posts, total = [self.public(post)], 1
+            else:
+                posts = [post for post in self.posts.values() if self.visible(post, now) and
+                         (not params.get('tag') or params['tag'] in post['tags']) and
+                         (not params.get('before') or post['timestamp'] < int(params['before']))]
+                posts.sort(key=lambda post: (post['timestamp'], post['id']), reverse=True)
+                total = len(posts)
+                offset, limit = int(params.get('offset') or 0), min(int(params.get('limit') or self.page_limit), self.page_limit)
+                posts = [self.public(post) for post in posts[offset:offset + limit]]
+        return self.reply(rq, 200, response={'blog': {'name': blog}, 'posts': posts, 'total_posts': total})
+
+    def create(self, rq, blog, params):
+        """ create photo/video post (dated by date param as tumblr does), visible after processing delay """
+        ptype = params.get('type', 'photo')
+        tags = [tag for tag in params.get('tags', '').split(',') if tag]
+        now = time.time()
+        try:
+            stamp = calendar.timegm(time.strptime(params['date'].replace(' GMT', ''), '%Y-%m-%d %H:%M:%S'))
+        except (KeyError, ValueError):
+            stamp = int(now)
+        with self.lock:
+            if ptype == 'video' and not self.stable_id:
+                # temporary id visible while transcoding, then final post
+                id = self.new_post(ptype, tags, stamp, visible=now, state='transcoding', until=now + self.video_delay)
+                self.new_post(ptype, tags, stamp, visible=now + self.video_delay)
+            elif ptype == 'video':
+                id = self.new_post(ptype, tags, stamp, visible=now, state='transcoding')
+                self.posts[id]['_published'] = now + self.video_delay
+            else:
+                id = self.new_post(ptype, tags, stamp, visible=now + self.photo_delay)
+        return self.reply(rq, 201, response={'id': id, 'id_string': str(id)})
+
+    def edit(self, rq, params):
+        with self.lock:
+            post = self.posts.get(int(params.get('id') or 0))
+            if not post:
+                return self.reply(rq, 404, {'title': 'Not Found', 'code': 0, 'detail': 'Post or endpoint not found'})
+            if 'tags' in params:
+                post['tags'] = [tag for tag in params['tags'].split(',') if tag]
+        return self.reply(rq, 200, response={'id': post['id']})
+
+    def delete(self, rq, params):
+        with self.lock:
+            post = self.posts.pop(int(params.get('id') or 0), None)
+        if not post:
+            return self.reply(rq, 404, {'title': 'Not Found', 'code': 0, 'detail': 'Post or endpoint not found'})
+        return self.reply(rq, 200, response={'id': post['id']})
+
+
+def option(name, default):
+    """ --name=value from command line converted to type of default """
+    for arg in sys.argv[1:]:
+        if arg.startswith('--' + name + '='):
+            return type(default)(arg.split('=', 1)[1])
+        if arg == '--' + name and isinstance(default, bool):
+            return True
+    return default
+
+
+if __name__ == '__main__':
+    mock = MockTumblr(host=option('host', '127.0.0.1'), port=option('port', 8080),
+                      latency=option('latency', 0.0), jitter=option('jitter', 0.0),
+                      photo_delay=option('photo-delay', 0.5), video_delay=option('video-delay', 2.0),
+                      page_limit=option('page-limit', 20), error_rate=option('error-rate', 0.0),
+                      error_status=option('error-status', 503), stable_id=option('stable-id', False),
+                      media_size=option('media-size', 64 * 1024))
+    mock.add_posts(option('posts', 0), tags=['mock'])
+    print("MOCK: %s (options api_host)" % mock.url)
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("STATS:", json.dumps(mock.stats, sort_keys=True))
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+"""
+SessionRunner class for session mode - stream of commands (JSON lines or CLI syntax) from file or stdin
+run through one authenticated, connection-pooled TumblrSimple session
+
+    add-tag tag1,tag2 123456                                    ... CLI syntax (shell quoting)
+    {"action": "find-id", "args": ["123456"], "ref": "my-1"}    ... JSON line, optional ref is echoed in result
+
+independent commands run concurrently in bounded worker pool, commands touching the same post id (or file)
+keep their order, results are JSON lines yielded as commands complete:
+
+    {"seq": 1, "ref": "my-1", "action": "find-id", "args": ["123456"], "ok": true, "result": {...}, "error": null}
+
+"""
+
+__VERSION__ = '2020.08.04'
+
+import json, shlex, threading, queue
+
+
+class SessionRunner:
+    """ run stream of commands concurrently through one TumblrSimple session """
+
+    # alias -> action
+    aliases = {
+        'id': 'find-id', 'find': 'find-tag', 'tag': 'find-tag', 'list-tags': 'list-tag',
+        'del-id': 'delete-id', 'rm-id': 'delete-id', 'remove-id': 'delete-id',
+        'add-tags': 'add-tag', 'del-tags': 'del-tag', 'rm-tag': 'del-tag', 'rm-tags': 'del-tag',
+        'image': 'photo', 'picture': 'photo', 'vid': 'video', 'mp4': 'video'
+    }
+
+    # post id argument for all posts of blog
+    all_ids = ('*', 'all', '-')
+
+    # action -> number of args
+    actions = {
+        'info': 0, 'find-id': 1, 'find-tag': 1, 'list-tag': 1, 'delete-id': 1,
+        'add-tag': 2, 'del-tag': 2, 'photo': 3, 'video': 3
+    }
+
+    def __init__(self, tumblr, workers=None, limit=None):
+        """ init with TumblrSimple session, max concurrent commands (options batch_workers) and limit for find-tag """
+        self.tumblr = tumblr
+        self.workers = workers or tumblr.options.get("batch_workers", 4)
+        self.limit = limit
+
+    @staticmethod
+    def ids(csv):
+        return [id.strip() for id in ("%s" % csv).split(',') if id.strip()]
+
+    def parse(self, line, seq):
+        """ command dict (seq, ref, action, args, keys) from JSON or CLI syntax line, None for blank/comment line """
+        line = line.strip()
+        if not line or line.startswith('#'):
+            return None
+        cmd = {'seq': seq, 'ref': None, 'action': None, 'args': [], 'keys': set(), 'error': None}
+        try:
+            if line.startswith('{'):
+                data = json.loads(line)
+                cmd['ref'], cmd['action'], cmd['args'] = data.get('ref'), data.get('action'), ["%s" % arg for arg in data.get('args', [])]
+            else:
+                words = shlex.split(line)
+                cmd['action'], cmd['args'] = words[0], words[1:]
+        except (ValueError, IndexError, AttributeError) as e:
+            cmd['error'] = "ERROR: broken command - %s" % e
+            return cmd
+        cmd['action'] = self.aliases.get(("%s" % cmd['action']).lower(), ("%s" % cmd['action']).lower())
+        if cmd['action'] not in self.actions:
+            cmd['error'] = "ERROR: unknown action: %s" % cmd['action']
+        elif len(cmd['args']) < self.actions[cmd['action']]:
+            cmd['error'] = "ERROR: %s requires %d parameter(s)" % (cmd['action'], self.actions[cmd['action']])
+        # ordering keys - post ids or media file, all posts (*) is ordered with every command
+        elif cmd['action'] in ('list-tag', 'delete-id') and cmd['args'][0] in self.all_ids:
+            cmd['keys'] = set(['*'])
+        elif cmd['action'] in ('find-id', 'list-tag', 'delete-id'):
+            cmd['keys'] = set(self.ids(cmd['args'][0]))
+        elif cmd['action'] in ('add-tag', 'del-tag'):
+            cmd['keys'] = set(self.ids(cmd['args'][1]))
+        elif cmd['action'] in ('photo', 'video'):
+            cmd['keys'] = set([cmd['args'][0]])
+        return cmd
+
+    def call(self, twin, cmd):
+        """ run command in worker clone, return (result, error) """
+        action, args = cmd['action'], cmd['args']
+        if action == 'info':
+            result = twin.response if twin.info_rq() else None
+        elif action == 'find-id':
+            result = twin.find_id_get_post(args[0])
+        elif action == 'find-tag':
+            result = twin.find_tag_get_ids(args[0], limit=self.limit)
+            result = result if twin.response_is_ok() else None
+        elif action == 'list-tag' and args[0] in self.all_ids:
+            result = dict(twin.iter_posts_tags(limit=self.limit))
+            result = result if twin.response_is_ok() else None
+        elif action == 'list-tag':
+            result = {}
+            for id in self.ids(args[0]):
+                tags = twin.find_id_get_tags(id)
+                if tags is None:
+                    result = None
+                    break
+                result[id] = tags
+        elif action == 'delete-id':
+            # id -> true or error, the command fails if any delete fails
+            ids = None if args[0] in self.all_ids else self.ids(args[0])
+            result = dict([(id, err or True) for id, ok, err in twin.bulk_delete(ids=ids, limit=self.limit)])
+            if not twin.response_is_ok():
+                return None, twin.last_error()
+            failed = [err for err in result.values() if err is not True]
+            if failed:
+                return result, "ERROR: %d of %d deletes failed - %s" % (len(failed), len(result), failed[-1])
+        elif action in ('add-tag', 'del-tag'):
+            edit = twin.id_add_tags if action == 'add-tag' else twin.id_del_tags
+            result = {}
+            for id in self.ids(args[1]):
+                # new tags are known from the edit - no request to read them back
+                tags = edit(id, args[0])
+                if tags is None:
+                    result = None
+                    break
+                result[id] = tags.as_list()
+        elif action == 'photo':
+            result = twin.upload_photo_get_id_url(args[0], args[1], args[2])
+        else:
+            result = twin.upload_video_get_id_url(args[0], args[1], args[2])
+        if result is None or result is False:
+            return None, twin.last_error() or "ERROR: %s failed" % action
+        return result, None
+
+    def report(self, cmd, result=None, error=None):
+        """ result dict of command """
+        return {'seq': cmd['seq'], 'ref': cmd['ref'], 'action': cmd['action'], 'args': cmd['args'],
+                'ok': error is None, 'result': result, 'error': error}
+
+    def run(self, lines):
+        """ run commands from iterable of lines, yield result dicts as commands complete """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        # lines are read in background, so results are not delayed by slow input (interactive stdin)
+        inbox = queue.Queue(maxsize=self.workers * 4)
+
+        def reader():
+            for line in lines:
+                inbox.put(line)
+            inbox.put(None)
+
+        threading.Thread(target=reader, daemon=True).start()
+        pending, running, seq, eof = [], {}, 0, False
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                # read available commands (block only if there is nothing to do)
+                while not eof and len(pending) < self.workers * 4:
+                    try:
+                        line = inbox.get(block=not running and not pending)
+                    except queue.Empty:
+                        break
+                    if line is None:
+                        eof = True
+                        break
+                    seq += 1
+                    cmd = self.parse(line, seq)
+                    if cmd is None:
+                        continue
+                    if cmd['error']:
+                        yield self.report(cmd, error=cmd['error'])
+                        continue
+                    pending.append(cmd)
+                # start commands in order, skip ones touching keys of running or earlier pending commands
+                blocked = set().union(*[cmd['keys'] for cmd in running.values()])
+                for cmd in list(pending):
+                    if len(running) >= self.workers:
+                        break
+                    if not (cmd['keys'] & blocked or cmd['keys'] and '*' in blocked or '*' in cmd['keys'] and blocked):
+                        pending.remove(cmd)
+                        running[pool.submit(self.call, self.tumblr.clone(), cmd)] = cmd
+                    blocked |= cmd['keys']
+                if not running:
+                    if eof and not pending:
+                        break
+                    continue
+                # results as they complete, poll input while waiting
+                done, _ = wait(list(running), timeout=None if eof else 0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    cmd = running.pop(future)
+                    try:
+                        result, error = future.result()
+                    except Exception as e:
+                        result, error = None, "ERROR: %s - %s" % (type(e).__name__, e)
+                    yield self.report(cmd, result, error)
@@ -14,36 +14,61 @@ install:        pip3 install PyTumblr
 
 __VERSION__ = '2020.08.04'
 
-import os, json, sys
-import re, datetime, time
-import pytumblr
+import os, json, sys, glob, copy
+import re, datetime, time, random
+import threading, hashlib, calendar, functools
+# pytumblr (OAuth/HTTP stack), asyncio and concurrent.futures are imported lazily on first use for fast CLI startup
 
 # Max 20 Tags -  https://unwrapping.tumblr.com/tagged/tumblr-limits
 
 
 class Tags:
-    """ tags class for working with tags as csv string and tags as list """
+    """ tags class for working with tags as csv string and tags as list
+
+        tags are kept in insertion ordered set (dict keys) with O(1) membership
+    """
+
+    # rectified items cache (sep, casefnc, item) -> rectified item
+    rectified = {}
+
+    # max cached items
+    rectified_max = 100000
 
     def __init__(self, data=None, sep=',', casefnc=str.lower):
-        """ init from optional data (string or list or csv), optional separator and unicode case-function """
+        """ init from optional data (string or list or csv or Tags), optional separator and unicode case-function """
         # store csv separator
         self.sep = sep
         # store case function
         self.casefnc = casefnc
-        # rectify and convert to list
-        self.lst = self._to_relist(data) if data else []
+        # rectify and convert to ordered set
+        self.tags = dict.fromkeys(self._to_relist(data)) if data else {}
+
+    @property
+    def lst(self):
+        """ tags as list """
+        return list(self.tags)
 
     def _rectify_item(self, item):
-        """ preprocess single item - unicode, stip, lower/upper/title """
+        """ preprocess single item - unicode, stip, lower/upper/title, cached """
+        key = (self.sep, self.casefnc, item)
+        result = self.rectified.get(key)
+        if result is not None:
+            return result
         # force unicode - python2 only
         #item = unicode(item, 'utf8') if type(item) == str else item
         # stip whitespaces, strip seprators
-        item = item.strip().strip(self.sep).strip()
+        result = item.strip().strip(self.sep).strip()
         # optional custom case conversion
-        return item if self.casefnc is None else self.casefnc(item)
+        result = result if self.casefnc is None else self.casefnc(result)
+        if len(self.rectified) < self.rectified_max:
+            self.rectified[key] = result
+        return result
 
     def _to_relist(self, par):
         """ convert par to rectified list """
+        # already rectified tags
+        if isinstance(par, Tags):
+            return par.lst if (par.sep, par.casefnc) == (self.sep, self.casefnc) else self._to_relist(par.lst)
         # assume csv if separator found in par
         par = par.split(self.sep) if self.sep in par else par
         # convert to list even if single item
@@ -52,16 +77,23 @@ class Tags:
         return list(map(self._rectify_item, par))
 
     def as_string(self):
-        return self.sep.join(self.lst)
+        return self.sep.join(self.tags)
 
     def as_list(self):
-        return self.lst
+        return list(self.tags)
+
+    def __contains__(self, item):
+        return self._rectify_item(item) in self.tags
+
+    def __iter__(self):
+        return iter(self.tags)
+
+    def __len__(self):
+        return len(self.tags)
 
     def _remove1(self, item):
         """ remove single item """
-        # remove
-        if item in self.lst:
-            self.lst.remove(item)
+        self.tags.pop(item, None)
         return self
 
     def remove(self, data):
@@ -74,9 +106,16 @@ class Tags:
     def _add1(self, item, pos=None):
         """ add single item at optional position pos - append by default """
         # avoid duplicitiy
-        if item not in self.lst:
-            # insert or append
-            self.lst.append(item) if pos is None else self.lst.insert(pos, item)
+        if item in self.tags:
+            return self
+        # append
+        if pos is None:
+            self.tags[item] = None
+            return self
+        # insert - rebuild ordered set
+        lst = list(self.tags)
+        lst.insert(pos, item)
+        self.tags = dict.fromkeys(lst)
         #
         return self
 
@@ -89,20 +128,717 @@ class Tags:
 
     def limit_len(self, minlen=5):
         """ elmininate tags shorter than minlen """
-        self.lst = list(filter(lambda tag: len(tag) >= minlen, self.lst))
+        self.tags = dict.fromkeys([tag for tag in self.tags if len(tag) >= minlen])
         return self
 
     def limit_num(self, maxnum=20):
-        """ limit number of tags by removing shortest ones """
-        # start eliminating the shortest tag
-        for tag in sorted(self.lst, key=len):
-            # we are done when number <= maxnum
-            if len(self.lst) <= maxnum: break
-            # remove shortest tag
-            self.lst.remove(tag)
-        #
+        """ limit number of tags by removing shortest ones (the first ones of equal length) """
+        excess = len(self.tags) - maxnum
+        # we are done when number <= maxnum
+        if excess <= 0:
+            return self
+        # the shortest tags to be removed (stable sort)
+        drop = set(sorted(self.tags, key=len)[:excess])
+        self.tags = dict.fromkeys([tag for tag in self.tags if tag not in drop])
         return self
 
+    # set-style bulk operations
+
+    def copy(self):
+        """ new tags with the same items, separator and case function """
+        tgs = Tags(sep=self.sep, casefnc=self.casefnc)
+        tgs.tags = dict(self.tags)
+        return tgs
+
+    def union(self, data):
+        """ new tags with items from list or item or csv or Tags appended """
+        return self.copy().add(data)
+
+    def difference(self, data):
+        """ new tags without items from list or item or csv or Tags """
+        return self.copy().remove(data)
+
+    def diff(self, current):
+        """ compare with current tags (list as stored in post) rectified the same way, return (added list, removed list) """
+        cur = Tags(current or [], sep=self.sep, casefnc=self.casefnc).tags
+        added = [tag for tag in self.tags if tag not in cur]
+        removed = [tag for tag in cur if tag not in self.tags]
+        return added, removed
+
+    def changed(self, current):
+        """ True if tags differ from current tags (list as stored in post) - edit is required """
+        added, removed = self.diff(current)
+        return bool(added or removed)
+
+
+class Poll:
+    """ fixed interval polling for server processing - wait seconds between polls, max rounds """
+
+    def __init__(self, wait=5, rounds=20):
+        """ init with wait interval and max number of rounds, start measuring processing time """
+        self.wait = wait
+        self.rounds = rounds
+        self.start = time.time()
+
+    def delays(self):
+        """ generate delays before each poll """
+        for i in range(self.rounds):
+            yield self.wait
+
+    def done(self):
+        """ processing finished, return elapsed time """
+        return time.time() - self.start
+
+
+class BackoffPoll(Poll):
+    """ exponential backoff polling with jitter - start fast, multiply delay by factor up to cap, max timeout total """
+
+    def __init__(self, timeout=100, initial=0.5, factor=2.0, cap=30, jitter=0.25):
+        """ init with total timeout, initial delay, backoff factor, delay cap and relative jitter """
+        super().__init__()
+        self.timeout = timeout
+        self.initial = initial
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+
+    def first_delay(self):
+        """ delay before the first poll """
+        return self.initial
+
+    def backoff(self):
+        """ generate raw delays - the first delay, then initial multiplied by factor up to cap """
+        yield self.first_delay()
+        delay = self.initial
+        while True:
+            delay = min(delay * self.factor, self.cap)
+            yield delay
+
+    def delays(self):
+        """ generate backoff delays with jitter until total timeout is reached """
+        total = 0
+        for delay in self.backoff():
+            if total >= self.timeout: break
+            # jitter avoids polling of concurrent uploads in lockstep
+            sec = min(delay * random.uniform(1 - self.jitter, 1 + self.jitter), self.timeout - total)
+            total += sec
+            yield sec
+
+
+class AdaptivePoll(BackoffPoll):
+    """ backoff polling with the first poll at learned completion time for media type and size class """
+
+    # history file -> {key: [elapsed, ...]} shared by all instances
+    histories = {}
+
+    # history lock (clones in worker threads)
+    lock = threading.Lock()
+
+    # keep only last samples per key
+    samples = 20
+
+    def __init__(self, history, mtype, size, **kwargs):
+        """ init with history filename, media type, media size and backoff parameters """
+        super().__init__(**kwargs)
+        self.history = history
+        # size class log2(bytes)
+        self.key = "%s:%d" % (mtype, size.bit_length())
+        self.load()
+
+    def load(self):
+        """ load history file only once per process """
+        with self.lock:
+            if self.history in self.histories: return
+            try:
+                with open(self.history, "r") as f:
+                    self.histories[self.history] = json.loads(f.read())
+            except (IOError, ValueError):
+                self.histories[self.history] = {}
+
+    def first_delay(self):
+        """ slightly less than median of past completion times, initial if not learned yet """
+        past = sorted(self.histories[self.history].get(self.key, []))
+        return max(self.initial, 0.8 * past[len(past) // 2]) if past else self.initial
+
+    def done(self):
+        """ record elapsed time to history and save history file """
+        elapsed = super().done()
+        with self.lock:
+            hist = self.histories[self.history]
+            hist[self.key] = (hist.get(self.key, []) + [round(elapsed, 3)])[-self.samples:]
+            # atomic write
+            tmp = self.history + '.tmp'
+            with open(tmp, "w") as f:
+                f.write(json.dumps(hist))
+            os.replace(tmp, self.history)
+        return elapsed
+
+
+class PendingPosts:
+    """ shared tracker of uploaded posts waiting for server processing - all pending posts of blog are checked by one
+        listing request per round (posts around their dates, also transcoding ones where listed), only stragglers
+        outside of the listing (or missing from it for the first time and then every straggle rounds) are looked up by id
+    """
+
+    def __init__(self, interval=0.0, page=20, straggle=5):
+        """ init with min seconds between listing rounds, listing page size and rounds before per id lookup """
+        self.interval, self.page, self.straggle = interval, page, straggle
+        self.lock = threading.Lock()
+        # key -> waiter (id, tag, published, timestamp, post found by listing, straggler flag, rounds missed, last check)
+        self.waiters = {}
+        self.seq = 0
+        # start time of the last listing round, round in flight
+        self.stamp, self.running = 0, False
+
+    def add(self, timestamp, id, tag=None, published=False):
+        """ register pending post id dated timestamp - done when id is listed (and published if published),
+            with tag when other post tagged with tag is published (temporary video id replaced by final post),
+            return key
+        """
+        with self.lock:
+            self.seq += 1
+            self.waiters[self.seq] = {'id': int(id), 'tag': tag, 'published': published, 'timestamp': timestamp,
+                                      'post': None, 'straggler': False, 'missed': 0, 'checked': time.time()}
+            return self.seq
+
+    def remove(self, key):
+        with self.lock:
+            self.waiters.pop(key, None)
+
+    @staticmethod
+    def match(waiter, posts, oldest):
+        """ listed post resolving waiter, False if still pending, None if waiter is not covered by listing (older than oldest) """
+        for post in posts:
+            id = int(post.get("id", 0))
+            if waiter['tag']:
+                if id != waiter['id'] and waiter['tag'] in post.get("tags", []) and post.get("state", "published") == "published":
+                    return post
+            elif id == waiter['id']:
+                return post if not waiter['published'] or post.get("state") == "published" else False
+        return False if waiter['timestamp'] > oldest else None
+
+    def round(self, twin):
+        """ check all pending posts with one listing request (posts before the newest pending one) - pending posts are
+            taken under lock, but the request is sent without it, so other waiters do not wait for network
+        """
+        with self.lock:
+            waiters = [waiter for waiter in self.waiters.values() if not waiter['post']]
+            before = max([waiter['timestamp'] for waiter in waiters]) + 1 if waiters else None
+        ok = waiters and twin.posts_rq(before=before, limit=self.page)
+        posts = twin.response.get("posts", []) if ok else []
+        # the whole blog before is covered by not full page
+        oldest = posts[-1].get("timestamp", 0) if len(posts) >= self.page else -1
+        with self.lock:
+            self.running = False
+            for waiter in waiters:
+                # listing failed - all are stragglers
+                if not ok:
+                    waiter['straggler'] = True
+                    continue
+                post = self.match(waiter, posts, oldest)
+                # missing from listing (date not as sent) - look up by id on the first miss and then every straggle rounds
+                waiter['missed'] = 0 if post is not False else waiter['missed'] + 1
+                waiter['post'] = post or None
+                waiter['straggler'] = post is None or (post is False and waiter['missed'] % self.straggle == 1 % self.straggle)
+
+    def check(self, twin, key, lookup=False):
+        """ check pending post key in twin (worker clone) - post (also set as twin response) if done, True if done
+            without post (temporary id not found any more), False if pending; listing round started after the previous
+            check of waiter is reused (new round at most every interval seconds, one at a time), so concurrent waiters share one request,
+            straggler (or any waiter with lookup) is looked up by id once per round
+        """
+        with self.lock:
+            waiter, now = self.waiters[key], time.time()
+            start = not waiter['post'] and not self.running and self.stamp <= waiter['checked'] and now - self.stamp >= self.interval
+            if start: self.stamp, self.running = now, True
+        if start:
+            try:
+                self.round(twin)
+            finally:
+                self.running = False
+        with self.lock:
+            post, straggler = waiter['post'], waiter['straggler'] or lookup
+            waiter['straggler'], waiter['checked'] = False, now
+        if post:
+            twin.response = {"posts": [post]}
+            return post
+        if not straggler:
+            return False
+        # per id fallback - only temporary id not found is done, other failures keep polling
+        if not twin.find_id_rq(waiter['id']):
+            return waiter['tag'] is not None and twin.response_is_not_found()
+        post = twin.response["posts"][0]
+        if waiter['tag'] or (waiter['published'] and post.get("state") != "published"):
+            return False
+        return post
+
+
+class RateLimiter:
+    """ client side token bucket rate limiter for tumblr API limits
+
+        limits are {request class: [[number, window seconds], ...]}, request class api is consumed by all requests,
+        post + photo / post + video by uploads. Buckets refill continuously, so waiting requests (uploads)
+        are spread over the allowed window instead of failing. State persists across runs in optional file
+    """
+
+    # request class -> consumed buckets classes
+    consumes = {
+        'api':      ['api'],
+        'photo':    ['api', 'post', 'photo'],
+        'video':    ['api', 'post', 'video']
+    }
+
+    def __init__(self, limits, statefile=None, max_wait=3600):
+        """ init from limits, optional state filename and max wait for quota in seconds """
+        self.limits = limits
+        self.statefile = statefile
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        # bucket key 'class:window' -> [tokens, timestamp], full buckets by default
+        self.buckets = dict([(self.key(rqclass, window), [number, time.time()])
+                             for rqclass, lst in limits.items() for number, window in lst])
+        self.load()
+
+    @staticmethod
+    def key(rqclass, window):
+        return "%s:%d" % (rqclass, window)
+
+    def load(self):
+        """ load state of buckets from statefile """
+        if not self.statefile: return
+        try:
+            with open(self.statefile, "r") as f:
+                state = json.loads(f.read())
+        except (IOError, ValueError):
+            return
+        for key, bucket in state.items():
+            if key in self.buckets: self.buckets[key] = bucket
+
+    def save(self):
+        """ atomic save of buckets to statefile """
+        if not self.statefile: return
+        tmp = self.statefile + '.tmp'
+        with open(tmp, "w") as f:
+            f.write(json.dumps(self.buckets))
+        os.replace(tmp, self.statefile)
+
+    def bucket_list(self, rqclass):
+        """ list of (key, number, window) for all buckets consumed by request class """
+        return [(self.key(cls, window), number, window)
+                for cls in self.consumes.get(rqclass, ['api', rqclass]) for number, window in self.limits.get(cls, [])]
+
+    def refill(self, now):
+        """ refill all buckets up to now """
+        for cls, lst in self.limits.items():
+            for number, window in lst:
+                bucket = self.buckets[self.key(cls, window)]
+                bucket[0] = min(number, bucket[0] + (now - bucket[1]) * number / window)
+                bucket[1] = now
+
+    def eta(self, rqclass, n=1):
+        """ seconds until n requests of request class are available """
+        with self.lock:
+            self.refill(time.time())
+            return max([0] + [(n - self.buckets[key][0]) * window / number for key, number, window in self.bucket_list(rqclass)])
+
+    def acquire(self, rqclass):
+        """ consume tokens for request class, wait for quota, return False if wait would exceed max_wait """
+        while True:
+            wait = self.eta(rqclass)
+            if wait > self.max_wait:
+                return False
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            with self.lock:
+                # other thread could be faster
+                self.refill(time.time())
+                if any([self.buckets[key][0] < 1 for key, number, window in self.bucket_list(rqclass)]):
+                    continue
+                for key, number, window in self.bucket_list(rqclass):
+                    self.buckets[key][0] -= 1
+                self.save()
+            return True
+
+    def remaining(self):
+        """ dict bucket key -> remaining number of requests """
+        with self.lock:
+            self.refill(time.time())
+            return dict([(key, int(bucket[0])) for key, bucket in self.buckets.items()])
+
+    def quota_str(self):
+        """ remaining quota as human readable string """
+        units = {3600: 'h', 86400: 'day'}
+        quota = []
+        for key, left in sorted(self.remaining().items()):
+            cls, window = key.split(':')
+            quota.append("%s/%s %d" % (cls, units.get(int(window), window + 's'), left))
+        return ', '.join(quota)
+
+
+class RetryPolicy:
+    """ retry of transient API and network failures - classified by meta status and errors code, exponential backoff
+        with jitter (Retry-After honored), max attempts per request and error budget (retries per run) shared by clones
+    """
+
+    # meta status of network failure (connection reset, timeout) response
+    network_status = 599
+
+    def __init__(self, status=(429, 500, 502, 503, 504), codes=(), fatal=(), attempts=4, initial=1.0, factor=2.0,
+                 cap=60, jitter=0.25, max_wait=300, budget=50):
+        """ init with retryable meta status and errors codes, fatal errors codes, max attempts per request, backoff
+            parameters, max honored Retry-After seconds and error budget (None = unlimited)
+        """
+        self.status, self.codes, self.fatal = set(status), set(codes), set(fatal)
+        self.attempts = attempts
+        self.initial, self.factor, self.cap, self.jitter = initial, factor, cap, jitter
+        self.max_wait = max_wait
+        self.budget = budget
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_options(cls, options):
+        """ policy from options retry_* """
+        return cls(options.get("retry_status", (429, 500, 502, 503, 504)), options.get("retry_codes", ()),
+                   options.get("retry_fatal_codes", ()), options.get("retry_attempts", 4), options.get("retry_initial", 1.0),
+                   options.get("retry_factor", 2.0), options.get("retry_cap", 60), options.get("retry_jitter", 0.25),
+                   options.get("retry_max_wait", 300), options.get("retry_budget", 50))
+
+    def retryable(self, response, idempotent):
+        """ True if failed response is transient and request can be sent again - not idempotent request (upload)
+            only if it was surely not processed (429, connection not established)
+        """
+        meta = response.get("meta", {})
+        codes = set([err.get("code") for err in response.get("errors", []) if isinstance(err, dict)])
+        if codes & self.fatal or (meta.get("retry_after") or 0) > self.max_wait:
+            return False
+        if meta.get("status") == 429 or meta.get("sent") is False:
+            return True
+        return idempotent and (meta.get("status") in self.status or meta.get("status") == self.network_status or bool(codes & self.codes))
+
+    def delay(self, attempt, retry_after=None):
+        """ seconds before retry attempt (0 = the first retry), at least Retry-After """
+        delay = min(self.cap, self.initial * self.factor ** attempt)
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(delay, retry_after or 0)
+
+    def spend(self):
+        """ take one retry from error budget, False if spent """
+        with self.lock:
+            if self.budget is None:
+                return True
+            if self.budget <= 0:
+                return False
+            self.budget -= 1
+            return True
+
+
+class Metrics:
+    """ thread-safe metrics - latency histograms, counters and samples for percentiles,
+        exported as JSON summary or Prometheus textfile
+    """
+
+    # histogram buckets (seconds)
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf'))
+
+    # max samples kept per histogram for percentiles
+    samples_max = 10000
+
+    def __init__(self, prefix='tumblr_'):
+        """ init empty metrics with metric name prefix """
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        # (name, labels) -> [bucket counts, sum, count, samples]
+        self.histograms = {}
+        # (name, labels) -> value
+        self.counters = {}
+
+    @staticmethod
+    def labels_key(labels):
+        return tuple(sorted([(key, "%s" % val) for key, val in labels.items()]))
+
+    def observe(self, name, value, **labels):
+        """ observe value in histogram name with labels """
+        key = (name, self.labels_key(labels))
+        with self.lock:
+            hist = self.histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0, []])
+            for i, le in enumerate(self.buckets):
+                if value <= le: hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+            hist[3].append(value)
+            if len(hist[3]) > self.samples_max: del hist[3][0]
+
+    def inc(self, name, value=1, **labels):
+        """ increment counter name with labels by value """
+        key = (name, self.labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def timer(self, name, **labels):
+        """ context manager observing elapsed time in histogram name """
+        metrics = self
+
+        class Timer:
+            def __enter__(self):
+                self.start = time.time()
+                return self
+
+            def __exit__(self, *exc):
+                metrics.observe(name, time.time() - self.start, **labels)
+
+        return Timer()
+
+    def polls(self, delays, **labels):
+        """ pass through poll delays generator - count polls and observe whole wait phase when it is finished """
+        start, cnt = time.time(), 0
+        try:
+            for delay in delays:
+                cnt += 1
+                yield delay
+        finally:
+            self.inc('upload_polls_total', cnt, **labels)
+            self.observe('upload_phase_seconds', time.time() - start, phase='wait', **labels)
+
+    @staticmethod
+    def percentile(sorted_samples, p):
+        return sorted_samples[min(len(sorted_samples) - 1, int(p * len(sorted_samples)))] if sorted_samples else None
+
+    @staticmethod
+    def labels_str(labels):
+        return ','.join(["%s=%s" % kv for kv in labels])
+
+    def summary(self):
+        """ JSON-able summary - histograms with count, sum, avg, p50, p90, p99 and counters """
+        with self.lock:
+            hists = dict([(key, (hist[1], hist[2], sorted(hist[3]))) for key, hist in self.histograms.items()])
+            counters = dict(self.counters)
+        summary = {'histograms': {}, 'counters': {}}
+        for (name, labels), (total, count, samples) in sorted(hists.items()):
+            summary['histograms'].setdefault(name, {})[self.labels_str(labels)] = {
+                'count':    count,
+                'sum':      round(total, 6),
+                'avg':      round(total / count, 6) if count else None,
+                'p50':      self.percentile(samples, 0.50),
+                'p90':      self.percentile(samples, 0.90),
+                'p99':      self.percentile(samples, 0.99)
+            }
+        for (name, labels), value in sorted(counters.items()):
+            summary['counters'].setdefault(name, {})[self.labels_str(labels)] = value
+        return summary
+
+    def save_json(self, filename):
+        """ save JSON summary to filename """
+        with open(filename, "w") as f:
+            f.write(json.dumps(self.summary(), indent=4, sort_keys=True))
+
+    def prometheus(self):
+        """ metrics in Prometheus text exposition format """
+        def fmt(labels, extra=()):
+            lst = ['%s="%s"' % (key, val.replace('"', '\\"')) for key, val in list(labels) + list(extra)]
+            return '{%s}' % ','.join(lst) if lst else ''
+        lines = []
+        with self.lock:
+            for name in sorted(set([name for name, labels in self.histograms])):
+                lines.append("# TYPE %s%s histogram" % (self.prefix, name))
+                for (hname, labels), hist in sorted(self.histograms.items()):
+                    if hname != name: continue
+                    for le, cnt in zip(self.buckets, hist[0]):
+                        le = '+Inf' if le == float('inf') else '%s' % le
+                        lines.append("%s%s_bucket%s %d" % (self.prefix, name, fmt(labels, [('le', le)]), cnt))
+                    lines.append("%s%s_sum%s %s" % (self.prefix, name, fmt(labels), hist[1]))
+                    lines.append("%s%s_count%s %d" % (self.prefix, name, fmt(labels), hist[2]))
+            for name in sorted(set([name for name, labels in self.counters])):
+                lines.append("# TYPE %s%s counter" % (self.prefix, name))
+                for (cname, labels), value in sorted(self.counters.items()):
+                    if cname == name:
+                        lines.append("%s%s%s %s" % (self.prefix, name, fmt(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def save_prometheus(self, filename):
+        """ atomic save of Prometheus textfile (for node_exporter textfile collector) """
+        tmp = filename + '.tmp'
+        with open(tmp, "w") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, filename)
+
+
+class MultipartStream:
+    """ file-like multipart/form-data body - form fields and one media file streamed from disk,
+        every read returns max chunk bytes, so memory use does not depend on media size
+    """
+
+    def __init__(self, fields, name, path, chunk=1 << 20, callback=None):
+        """ fields dict, file part name, media path, max bytes per read and optional callback(sent, size) """
+        self.boundary = hashlib.md5(os.urandom(16)).hexdigest()
+        self.chunk = chunk
+        self.callback = callback
+        head = b''.join([('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n' % (self.boundary, key)).encode('utf-8') +
+                         val.encode('utf-8') + b'\r\n' for key, val in self.form_fields(fields).items()])
+        head += ('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                 'Content-Type: application/octet-stream\r\n\r\n' % (self.boundary, name, os.path.basename(path).replace('"', '%22'))).encode('utf-8')
+        tail = ('\r\n--%s--\r\n' % self.boundary).encode('utf-8')
+        self.size = len(head) + os.path.getsize(path) + len(tail)
+        self.sent = 0
+        # head, media file, tail are read in turn
+        self.file = open(path, "rb")
+        self.parts = [(head, None), (None, self.file), (tail, None)]
+
+    @staticmethod
+    def form_fields(fields):
+        """ form fields as strings the way requests sends params - None and empty values dropped, lists joined by comma """
+        return dict([(key, ",".join(["%s" % v for v in val]) if isinstance(val, (list, tuple)) else "%s" % val)
+                     for key, val in fields.items() if val is not None and val != '' and val != [] and val != ()])
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        """ read max size (and max chunk) bytes, b'' at the end """
+        size = self.chunk if size is None or size < 0 else min(size, self.chunk)
+        data = []
+        while self.parts and size > 0:
+            buf, f = self.parts[0]
+            if f is None:
+                piece, self.parts[0] = buf[:size], (buf[size:], None)
+            else:
+                piece = f.read(size)
+            if not piece:
+                self.parts.pop(0)
+                continue
+            data.append(piece)
+            size -= len(piece)
+        data = b''.join(data)
+        self.sent += len(data)
+        if self.callback and data: self.callback(self.sent, self.size)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk), b'')
+
+    def close(self):
+        self.file.close()
+
+
+class Record:
+    """ base of compact __slots__ records created by Projection """
+
+    __slots__ = ()
+
+    def as_dict(self):
+        return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ', '.join(["%s=%r" % (name, getattr(self, name)) for name in self.__slots__]))
+
+
+class Projection:
+    """ extract set of named fields (post relative simplified xpaths) from posts in one pass into compact __slots__ records """
+
+    # xpath -> compiled steps cache
+    xpaths = {}
+
+    # default fields for post listing
+    default = {
+        'id':           '/id',
+        'type':         '/type',
+        'state':        '/state',
+        'timestamp':    '/timestamp',
+        'tags':         '/tags',
+        'url':          '/post_url'
+    }
+
+    # known fields by name
+    known = dict(default, **{
+        'date':         '/date',
+        'blog':         '/blog_name',
+        'slug':         '/slug',
+        'summary':      '/summary',
+        'notes':        '/note_count',
+        'photo':        '/photos[0]/original_size/url',
+        'video':        '/video_url'
+    })
+
+    # top level post keys kept in local index (TumblrIndex.as_post)
+    indexed = ('id', 'type', 'state', 'timestamp', 'tags', 'photos', 'video_url')
+
+    @classmethod
+    def parse_fields(cls, spec=None):
+        """ fields dict from csv spec of known field names or name=/xpath pairs (default fields if empty),
+            raise ValueError for unknown field name
+        """
+        if not spec:
+            return dict(cls.default)
+        fields = {}
+        for item in [item.strip() for item in spec.split(',') if item.strip()]:
+            name, _, xpath = item.partition('=')
+            if not xpath and name not in cls.known:
+                raise ValueError("unknown field: %s (known: %s)" % (name, ', '.join(sorted(cls.known))))
+            fields[name] = xpath or cls.known[name]
+        return fields
+
+    def __init__(self, fields=None, missing=None):
+        """ init from dict name -> post relative xpath (default fields), missing value for fields not in post """
+        fields = fields or self.default
+        self.fields = [(name, self.compile_xpath(xpath)) for name, xpath in fields.items()]
+        self.missing = missing
+        # record class with slots for fields
+        self.record = type('PostRecord', (Record,), {'__slots__': tuple(fields.keys())})
+
+    @classmethod
+    def compile_xpath(cls, xpath):
+        """ compile simplified xpath /key/list[idx]/key to cached tuple of keys and indexes """
+        steps = cls.xpaths.get(xpath)
+        if steps is not None:
+            return steps
+        steps = []
+        for key in xpath.strip('/').split('/'):
+            if not key: continue
+            # list[x] ?
+            m = re.match(r'^(\w+)\[(.*)\]$', key)
+            if m:
+                steps.append(m.group(1))
+                # list[] is entire list
+                if m.group(2) != '':
+                    steps.append(int(m.group(2)) if m.group(2).isdigit() else m.group(2))
+            else:
+                steps.append(key)
+        cls.xpaths[xpath] = tuple(steps)
+        return cls.xpaths[xpath]
+
+    @classmethod
+    def get_xpath(cls, obj, xpath):
+        """ get simplified xpath from obj """
+        for step in cls.compile_xpath(xpath):
+            obj = obj[step]
+        return obj
+
+    @staticmethod
+    def post_xpath(xpath, prefix='/posts[0]'):
+        """ convert response xpath (like photo_url, video_url options) to post relative xpath """
+        return xpath[len(prefix):] if xpath.startswith(prefix) else xpath
+
+    def project(self, post):
+        """ get record with all fields from post """
+        rec = self.record()
+        for name, steps in self.fields:
+            val = post
+            try:
+                for step in steps:
+                    val = val[step]
+            except (KeyError, IndexError, TypeError):
+                val = self.missing
+            setattr(rec, name, val)
+        return rec
+
+    def project_all(self, posts):
+        """ get list of records from list of posts """
+        return [self.project(post) for post in posts]
+
 
 class TumblrSimple:
     """ simple Tumblr operations """
@@ -110,17 +846,183 @@ class TumblrSimple:
     verbosity = 0
 
     api_rq_cnt = 0
+    api_retry_cnt = 0
+
+    # api_rq_cnt (and api_retry_cnt) is shared by clones running in worker threads
+    rq_lock = threading.Lock()
 
-    def __init__(self, consumer, oauth, blogname, options):
-        """ init tumblr with auth parameters, blogname and options """
-        self.tumblr = pytumblr.TumblrRestClient(
-            consumer["key"],
-            consumer["secret"],
-            oauth["token"],
-            oauth["token_secret"]
-        )
+    # startup timing of lazy imports (name -> seconds)
+    timing = {}
+
+    # media file extensions recognized for batch upload
+    photo_ext = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+    video_ext = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v', '.3gp')
+
+    def __init__(self, consumer, oauth, blogname, options, blogs=None):
+        """ init tumblr with auth parameters, blogname, options and optional list of other blogs for fan-out
+            (blog name or dict with blog_name and optional own consumer, oauth)
+        """
+        self.consumer = consumer
+        self.oauth = oauth
+        # pytumblr client is created on first use
+        self._tumblr = None
         self.blogname = blogname
         self.options  = options
+        self.blogs = blogs or []
+        # optional pooled requests session (use_session)
+        self.session = None
+        # clone parent for request counting
+        self.parent = None
+        self.response = {}
+        # optional local post index
+        self.index = None
+        if options.get("index_db"):
+            import tumblrindex
+            self.index = tumblrindex.TumblrIndex(options["index_db"])
+        # metrics shared by clones
+        self.metrics = Metrics()
+        # retry of transient failures (options retry_*), error budget shared by clones
+        self.retry = RetryPolicy.from_options(options) if options.get("retry_attempts", 4) > 1 else None
+        # optional client side rate limiter
+        self.limiter = RateLimiter(options["rate_limits"], options.get("rate_state"), options.get("rate_max_wait", 3600)) \
+            if options.get("rate_limits") else None
+        # optional manifest of uploaded media
+        self.manifest = None
+        if options.get("manifest_db"):
+            import tumblrindex
+            self.manifest = tumblrindex.UploadManifest(options["manifest_db"])
+        # optional crash-safe journal of upload phases (resume of interrupted uploads), entry of the current upload
+        self.journal, self.journal_key = None, None
+        if options.get("journal_file"):
+            import tumblrindex
+            self.journal = tumblrindex.UploadJournal(options["journal_file"], options.get("journal_fsync", True))
+        # optional photo preprocessing (resize/recompress) and video transcoding before upload
+        self.prep = None
+        if options.get("photo_max_dim") or options.get("video_transcode"):
+            import tumblrmedia
+            self.prep = tumblrmedia.MediaPrep(options, os.path.dirname(self.cache_path("media", "-")), self.video_ext)
+        # optional cached media metadata (capture time, camera, gps)
+        self.meta = None
+        if options.get("meta_db"):
+            import tumblrmedia
+            self.meta = tumblrmedia.MediaMeta(options["meta_db"], options.get("meta_workers", 8))
+        # upload data and post date (unix timestamp) of the last upload (original or prepared media)
+        self.upload_data = None
+        self.upload_stamp = None
+        # shared tracker of posts waiting for server processing (batched status polling)
+        self.pending = PendingPosts(options.get("poll_batch_interval", 0.0), options.get("page_size", 20),
+                                    options.get("poll_batch_straggle", 5)) \
+            if options.get("poll_batch", True) else None
+
+    @property
+    def tumblr(self):
+        """ pytumblr client - pytumblr is imported and client created on the first use """
+        if self._tumblr is None:
+            start = time.time()
+            import pytumblr
+            self.timing.setdefault('import pytumblr', time.time() - start)
+            self._tumblr = pytumblr.TumblrRestClient(
+                self.consumer["key"],
+                self.consumer["secret"],
+                self.oauth["token"],
+                self.oauth["token_secret"],
+                host=self.options.get("api_host", "https://api.tumblr.com")
+            )
+            # keep Retry-After of error responses for retry policy
+            rq = getattr(self._tumblr, "request", None)
+            if rq is not None:
+                rq.json_parse = functools.partial(self.json_parse, rq.json_parse)
+        return self._tumblr
+
+    @tumblr.setter
+    def tumblr(self, client):
+        self._tumblr = client
+
+    @staticmethod
+    def json_parse(parse, resp):
+        """ pytumblr json_parse with Retry-After header (seconds or HTTP date) of error response as meta retry_after """
+        data = parse(resp)
+        after = resp.headers.get("Retry-After") if resp is not None else None
+        if after and isinstance(data, dict) and isinstance(data.get("meta"), dict):
+            try:
+                data["meta"]["retry_after"] = max(0.0, float(after))
+            except ValueError:
+                import email.utils
+                try:
+                    data["meta"]["retry_after"] = max(0.0, email.utils.parsedate_to_datetime(after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        return data
+
+    def clone(self):
+        """ shallow copy sharing tumblr client, blogname and options, but with own response - for worker threads """
+        # create client to be shared by clones
+        self.tumblr
+        twin = copy.copy(self)
+        twin.parent = self
+        twin.api_rq_cnt = 0
+        twin.api_retry_cnt = 0
+        twin.response = {}
+        return twin
+
+    def use_session(self, pool=None):
+        """ send all requests of this instance and its clones through one requests.Session with pool of keep-alive
+            connections (options batch_workers) - pytumblr sends every request on new connection (TLS handshake)
+        """
+        import requests
+        from requests.exceptions import TooManyRedirects, HTTPError
+        from urllib.parse import urlencode
+        rq = self.tumblr.request
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool or self.options.get("batch_workers", 4))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        # the same requests as pytumblr TumblrRequest get/post/delete, only through session
+        def send(method, url, params, files=None):
+            url = rq.host + url
+            try:
+                if method == 'post' and files:
+                    resp = session.post(url, data=params, params=params, files=files, headers=rq.headers, allow_redirects=False, auth=rq.oauth)
+                elif method == 'post':
+                    resp = session.post(url, data=urlencode(params), headers=rq.headers, auth=rq.oauth)
+                else:
+                    resp = session.request(method, url + ("?" + urlencode(params) if params else ""), headers=rq.headers,
+                                           allow_redirects=False, auth=rq.oauth)
+            except (TooManyRedirects, HTTPError) as e:
+                resp = e.response
+            return rq.json_parse(resp)
+
+        rq.get = lambda url, params: send('get', url, params)
+        rq.post = lambda url, params={}, files=[]: send('post', url, params, files)
+        rq.delete = lambda url, params: send('delete', url, params)
+        self.session = session
+        return self
+
+    def use_blog(self, blog):
+        """ switch this (cloned) instance to another blog - name or dict with blog_name and optional own consumer, oauth,
+            local index belongs to the main blog only, manifest keeps uploads of the blog by its name,
+            other account gets own client and rate limits
+        """
+        blog = {"blog_name": blog} if isinstance(blog, str) else blog
+        self.blogname = blog["blog_name"]
+        self.index = None
+        # repeated fan-out skips blogs which already have the media
+        self.manifest = self.manifest.for_blog(self.blogname) if self.manifest else None
+        # pending posts are listed per blog
+        if self.pending:
+            self.pending = PendingPosts(self.pending.interval, self.pending.page, self.pending.straggle)
+        if blog.get("consumer") or blog.get("oauth"):
+            self.consumer = blog.get("consumer", self.consumer)
+            self.oauth = blog.get("oauth", self.oauth)
+            self._tumblr = None
+            if self.limiter:
+                state = self.options.get("rate_state")
+                if state:
+                    root, ext = os.path.splitext(state)
+                    state = "%s-%s%s" % (root, self.blogname, ext)
+                self.limiter = RateLimiter(self.options["rate_limits"], state, self.options.get("rate_max_wait", 3600))
+        return self
 
     @classmethod
     def no_warnings(cls):
@@ -138,7 +1040,7 @@ class TumblrSimple:
             cls.debug_json(3, "cfg:", cfg)
         except IOError:
             cfg = None
-        return cls(cfg["consumer"], cfg["oauth"], cfg["blog_name"], cfg["options"]) if cfg else None
+        return cls(cfg["consumer"], cfg["oauth"], cfg["blog_name"], cfg["options"], cfg.get("blogs")) if cfg else None
 
     @classmethod
     def cfg_filename(cls, exename, ext='.json'):
@@ -159,7 +1061,12 @@ class TumblrSimple:
     # helpers - consider them to be static or class methods
 
     def gmt_media(self, media):
-        """ get GMT time from media filename or file in isoformat YYYY-MM-DDTHH:mm:ss """
+        """ get GMT time from media metadata (options meta_db), filename or file in isoformat YYYY-MM-DDTHH:mm:ss """
+        # capture time from EXIF/mp4 headers
+        if self.meta:
+            gmt = self.meta.get(media).get('time')
+            if gmt:
+                return gmt
         # basename
         basenamemedia = os.path.basename(media)
         # default gmt from media file
@@ -174,6 +1081,42 @@ class TumblrSimple:
             gmt = "%s-%s-%sT%s:%s:%s" % (y, m, d, hh, mm, ss)
         return gmt
 
+    @classmethod
+    def media_type(cls, media):
+        """ get media type 'photo' or 'video' from file extension, None if unknown """
+        ext = os.path.splitext(media)[1].lower()
+        if ext in cls.photo_ext: return 'photo'
+        if ext in cls.video_ext: return 'video'
+        return None
+
+    @classmethod
+    def media_files(cls, pattern):
+        """ get sorted list of media files from directory or glob pattern """
+        # whole directory
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+        # only regular files with known media extension
+        return sorted([f for f in glob.glob(pattern) if os.path.isfile(f) and cls.media_type(f)])
+
+    def poller(self, mtype, media):
+        """ polling strategy for server processing of media type from options poll = fixed, backoff, adaptive """
+        wait, rounds = self.options.get("%s_wait" % mtype, 5), self.options.get("loop_wait", 100)
+        strategy = self.options.get("poll", "fixed")
+        if strategy == "fixed":
+            return Poll(wait=wait, rounds=rounds)
+        # the same total timeout as fixed polling
+        backoff = {
+            'timeout':  wait * rounds,
+            'initial':  self.options.get("poll_initial", 0.5),
+            'factor':   self.options.get("poll_factor", 2.0),
+            'cap':      self.options.get("poll_cap", wait * 3),
+            'jitter':   self.options.get("poll_jitter", 0.25)
+        }
+        if strategy == "adaptive":
+            size = os.path.getsize(media) if os.path.exists(media) else 0
+            return AdaptivePoll(self.options.get("poll_history", "tumblr-poll-history.json"), mtype, size, **backoff)
+        return BackoffPoll(**backoff)
+
     def sleep(self, sec):
         """ sleep sec seconds """
         time.sleep(sec)
@@ -184,114 +1127,236 @@ class TumblrSimple:
         sys.stdout.write(s)
         sys.stdout.flush()
 
+    def count_rq(self, counter='api_rq_cnt'):
+        """ count api request (or retry), also in parent(s) to keep totals correct across worker clones """
+        with self.rq_lock:
+            obj = self
+            while obj is not None:
+                setattr(obj, counter, getattr(obj, counter) + 1)
+                obj = obj.parent
+
+    @staticmethod
+    def call_rq(fnc, *args, **kwargs):
+        """ call tumblr api fnc(*args, **kwargs), network failure is returned as error response (meta status 599,
+            sent false if connection was not established)
+        """
+        try:
+            return fnc(*args, **kwargs)
+        except Exception as e:
+            import requests, urllib3
+            if not isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                raise
+            reason = getattr(e.args[0], "reason", None) if e.args else None
+            sent = not isinstance(e, requests.exceptions.ConnectTimeout) and not isinstance(reason, urllib3.exceptions.NewConnectionError)
+            return {"meta": {"status": RetryPolicy.network_status, "msg": "Network Error", "sent": sent},
+                    "errors": [{"title": "Network Error", "code": 0, "detail": "%s: %s" % (type(e).__name__, e)}]}
+
+    def api_rq(self, rqclass, label, fnc, *args, **kwargs):
+        """ call tumblr api fnc(*args, **kwargs) of request class (api, photo, video) within rate limits,
+            count request, debug response and return True if response is ok;
+            transient failures are retried by retry policy (uploads only if not processed), retries are counted apart
+        """
+        attempt = 0
+        while True:
+            # client side rate limits, wait for quota
+            if self.limiter and not self.limiter.acquire(rqclass):
+                self.response = {"meta": {"status": 429, "msg": "Limit Exceeded"},
+                                 "errors": [{"title": "Limit Exceeded", "code": 0,
+                                             "detail": "client rate limit quota for %s: %s" % (rqclass, self.limiter.quota_str())}]}
+                self.debug_json(1, label, self.response)
+                return False
+            with self.metrics.timer('rq_seconds', rq=fnc.__name__):
+                self.response = self.call_rq(fnc, *args, **kwargs)
+            self.count_rq('api_retry_cnt' if attempt else 'api_rq_cnt')
+            self.debug_json(1, label, self.response)
+            if self.response_is_ok():
+                return True
+            # error codes
+            meta = self.response.get("meta", {})
+            self.metrics.inc('rq_errors_total', rq=fnc.__name__, status=meta.get("status"),
+                             code=','.join(["%s" % err.get("code") for err in self.response.get("errors", []) if isinstance(err, dict)]))
+            # transient failure - retry after backoff (uploads are not idempotent)
+            if not self.retry or attempt + 1 >= self.retry.attempts or \
+               not self.retry.retryable(self.response, rqclass == 'api') or not self.retry.spend():
+                return False
+            self.metrics.inc('rq_retries_total', rq=fnc.__name__, status=meta.get("status"))
+            self.sleep(self.retry.delay(attempt, meta.get("retry_after")))
+            attempt += 1
+
+    def save_metrics(self):
+        """ export metrics to JSON summary (options metrics_json) and Prometheus textfile (options metrics_prom) """
+        if self.options.get("metrics_json"):
+            self.metrics.save_json(self.options["metrics_json"])
+        if self.options.get("metrics_prom"):
+            self.metrics.save_prometheus(self.options["metrics_prom"])
+
     # tumblr requests
 
     def info_rq(self):
         """ get info """
-        self.response = self.tumblr.info()
-        self.api_rq_cnt += 1
-        self.debug_json(1, "tumblr.info()", self.response)
-        return self.response_is_ok()
+        return self.api_rq('api', "tumblr.info()", self.tumblr.info)
+
+    def cache_path(self, *parts):
+        """ path in cache directory (options cache_dir), create directories """
+        path = os.path.join(os.path.expanduser(self.options.get("cache_dir", "~/.cache/tumblr-cli-uploadr")), *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def info_cached_rq(self, ttl=None):
+        """ get info, response cached on disk for ttl seconds (options auth_cache_ttl) keyed by token hash """
+        ttl = self.options.get("auth_cache_ttl", 3600) if ttl is None else ttl
+        token = "%s:%s:%s" % (self.consumer["key"], self.oauth["token"], self.oauth["token_secret"])
+        cachefile = self.cache_path("auth", "info-%s.json" % hashlib.sha256(token.encode()).hexdigest()[:32])
+        # valid cache
+        try:
+            if ttl and time.time() - os.path.getmtime(cachefile) < ttl:
+                with open(cachefile, "r") as f:
+                    self.response = json.loads(f.read())
+                self.debug_json(1, "cached tumblr.info()", self.response)
+                return True
+        except (IOError, ValueError):
+            pass
+        if not self.info_rq():
+            return False
+        # cache only valid response, readable only by owner
+        if ttl:
+            fd = os.open(cachefile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps(self.response))
+        return True
 
     def delete_post_rq(self, id):
         """ delete post id """
-        self.response = self.tumblr.delete_post(self.blogname, id)
-        self.api_rq_cnt += 1
-        self.debug_json(1, 'tumblr.delete_post(blogname=%s, id=%s)' % (self.blogname, id), self.response)
+        self.api_rq('api', 'tumblr.delete_post(blogname=%s, id=%s)' % (self.blogname, id),
+                    self.tumblr.delete_post, self.blogname, id)
+        # keep local index and manifest in sync
+        if self.index and id and self.response_is_ok():
+            self.index.delete([id])
+        if self.manifest and id and self.response_is_ok():
+            self.manifest.forget([id])
         return self.response_is_ok()
 
     def edit_post_rq(self, id, **kwargs):
         """ edit post id """
-        self.response = self.tumblr.edit_post(self.blogname, id=id, **kwargs)
-        self.api_rq_cnt += 1
-        self.debug_json(1, 'tumblr.edit_post(blogname=%s, id=%s)' % (self.blogname, id), self.response)
-        return self.response_is_ok()
+        return self.api_rq('api', 'tumblr.edit_post(blogname=%s, id=%s)' % (self.blogname, id),
+                           self.tumblr.edit_post, self.blogname, id=id, **kwargs)
 
-    def posts_rq(self):
-        """ get all posts """
-        self.response = self.tumblr.posts(self.blogname)
-        self.api_rq_cnt += 1
-        self.debug_json(1, 'tumblr.posts(blogname=%s)' % (self.blogname), self.response)
-        return self.response_is_ok()
+    def posts_rq(self, **params):
+        """ get page of posts, optional params offset, before, limit """
+        return self.api_rq('api', 'tumblr.posts(blogname=%s, params=%s)' % (self.blogname, params),
+                           self.tumblr.posts, self.blogname, **params)
 
     def find_id_rq(self, id):
         """ get post for specific id """
-        self.response = self.tumblr.posts(self.blogname, id=id)
-        self.api_rq_cnt += 1
-        self.debug_json(1, 'tumblr.posts(blogname=%s, id=%s)' % (self.blogname, id), self.response)
-        return self.response_is_ok()
+        return self.api_rq('api', 'tumblr.posts(blogname=%s, id=%s)' % (self.blogname, id),
+                           self.tumblr.posts, self.blogname, id=id)
 
-    def find_tag_rq(self, tag):
-        """ find post id with tag tag """
-        self.response =  self.tumblr.posts(self.blogname, tag=tag)
-        self.api_rq_cnt += 1
-        self.debug_json(1, 'tumblr.posts(blogname=%s, tag=%s)' % (self.blogname, tag), self.response)
-        return self.response_is_ok()
+    def find_tag_rq(self, tag, **params):
+        """ find post id with tag tag, optional params offset, before, limit """
+        return self.api_rq('api', 'tumblr.posts(blogname=%s, tag=%s, params=%s)' % (self.blogname, tag, params),
+                           self.tumblr.posts, self.blogname, tag=tag, **params)
 
-    def upload_photo_rq(self, photo, caption, csvtags, **kwargs):
-        """ upload photo with caption and tags """
-        #:param slug: a string, a short text summary to the end of the post url
-        #:param link: a string, the 'click-through' url you want on the photo
-        #:param source: a string, the photo source url
-        #
-        # default timestamp is UTC now
-        gmtstr = datetime.datetime.utcnow().isoformat(' ')
+    def posts_page_rq(self, tag=None, **params):
+        """ get page of posts optionally tagged with tag, params offset, before, limit """
+        return self.find_tag_rq(tag, **params) if tag else self.posts_rq(**params)
+
+    def media_date_tags(self, media, csvtags, pos=0):
+        """ get (gmt, list of tags) for media upload - csv tags with optional filename at pos, timestamp after it
+            and camera/gps from media metadata, limited by tag_min_len and tag_max_cnt
+        """
         # comma separated -> list, trim tags and skip empty tags
         tg = Tags(csvtags)
-        # optional add filename at the begining
+        # optional add filename at pos
         if self.options.get("auto_tag_filename"):
-            tg.add(os.path.basename(photo), pos=0)
-        # gmt from filename or file
-        gmt = self.gmt_media(photo)
-        gmtstr = gmt.replace('T', ' ')
+            tg.add(os.path.basename(media), pos=pos)
+        # gmt from metadata, filename or file
+        gmt = self.gmt_media(media)
         # optional add timestamp after the filename
         if self.options.get("auto_tag_timestamp"):
-            tg.add(gmt.replace('T', '-'), pos=1)
+            tg.add(gmt.replace('T', '-'), pos=pos + 1)
+        # optional camera and gps tags from metadata
+        meta = self.meta.get(media) if self.meta else {}
+        if self.options.get("auto_tag_camera") and meta.get('camera'):
+            tg.add(meta['camera'].replace(' ', '-'))
+        if self.options.get("auto_tag_gps") and meta.get('gps'):
+            tg.add("gps%+.2f%+.2f" % tuple(meta['gps']))
         # elmiminate shorter tags, limit number of tags and get in csv format as string
         ltags = tg.limit_len(minlen=self.options.get("tag_min_len", 5)).limit_num(maxnum=self.options.get("tag_max_cnt", 20)).as_list()
-        # post photo
-        self.response = self.tumblr.create_photo(
-            self.blogname, state="published", format="markdown",
-            tags=ltags, data=photo,
-            caption=caption, date=gmtstr + ' GMT',
-            **kwargs)
-        self.api_rq_cnt += 1
-        self.debug_json(1, 'tumblr.create_photo(photo=%s, date=%s, tags=%s, kwargs=%s)' \
-                        % (photo, gmtstr, ltags, kwargs), self.response)
-        # check response for errors
-        return self.response_is_ok()
+        #
+        return gmt, ltags
 
-    def upload_video_rq(self, video, caption, csvtags, **kwargs):
-        """ upload video with caption and tags """
+    def upload_photo_rq(self, photo, caption, csvtags, progress=None, data=None, **kwargs):
+        """ upload photo with caption and tags, optional already prepared upload data, progress str s[2] echoed for every 10% sent """
+        #:param slug: a string, a short text summary to the end of the post url
+        #:param link: a string, the 'click-through' url you want on the photo
+        #:param source: a string, the photo source url
+        #
+        # date and tags from original photo
+        gmt, ltags = self.media_date_tags(photo, csvtags, pos=0)
+        gmtstr = gmt.replace('T', ' ')
+        self.upload_stamp = calendar.timegm(time.strptime(gmt[:19], '%Y-%m-%dT%H:%M:%S'))
+        # optional resized/recompressed copy as upload data, original still drives date and tags
+        with self.metrics.timer('upload_phase_seconds', media='photo', phase='prepare'):
+            data = self.upload_data = data or (self.prep.prepared(photo) if self.prep else photo)
+        # bytes sent
+        self.metrics.inc('upload_bytes_total', os.path.getsize(data), media='photo')
+        # post photo, check response for errors
+        return self.api_rq('photo', 'tumblr.create_photo(photo=%s, date=%s, tags=%s, kwargs=%s)' % (data, gmtstr, ltags, kwargs),
+                           self.create_media,
+                           self.blogname, type="photo", state="published", format="markdown",
+                           tags=ltags, data=data, progress=progress,
+                           caption=caption, date=gmtstr + ' GMT',
+                           **kwargs)
+
+    def upload_video_rq(self, video, caption, csvtags, progress=None, data=None, **kwargs):
+        """ upload video with caption and tags, optional already prepared upload data, progress str s[2] echoed for every 10% sent """
         #:param slug: a string, a short text summary to the end of the post url
         #:param embed: a string, the emebed code that you'd like to upload
         #
-        # default timestap is UTC now
-        gmtstr = datetime.datetime.utcnow().isoformat(' ')
-        # comma separated -> list, trim tags and skip empty tags
-        tg = Tags(csvtags)
-        # optional add filename after uid
-        if self.options.get("auto_tag_filename"):
-            tg.add(os.path.basename(video), pos=1)
-        # gmt from filename or file
-        gmt = self.gmt_media(video)
+        # date and tags from original video (filename after uid)
+        gmt, ltags = self.media_date_tags(video, csvtags, pos=1)
         gmtstr = gmt.replace('T', ' ')
-        # optional add timestamp after uid,filename
-        if self.options.get("auto_tag_timestamp"):
-            tg.add(gmt.replace('T', '-'), pos=2)
-        # elmiminate shorter tags, limit number of tags and get in csv format as string
-        ltags = tg.limit_len(minlen=self.options.get("tag_min_len", 5)).limit_num(maxnum=self.options.get("tag_max_cnt", 20)).as_list()
-        # post video
-        self.response = self.tumblr.create_video(
-            self.blogname, state="published", format="markdown",
-            tags=ltags, data=video,
-            caption=caption, date=gmtstr + ' GMT',
-            **kwargs)
-        self.api_rq_cnt += 1
-        self.debug_json(1, 'tumblr.create_video(video=%s, date=%s, tags=%s, kwargs=%s)' \
-                        % (video, gmtstr, ltags, kwargs), self.response)
-        # check response for errors
-        return self.response_is_ok()
+        self.upload_stamp = calendar.timegm(time.strptime(gmt[:19], '%Y-%m-%dT%H:%M:%S'))
+        # optional transcoded copy as upload data, original still drives date and tags
+        with self.metrics.timer('upload_phase_seconds', media='video', phase='prepare'):
+            data = self.upload_data = data or (self.prep.prepared(video) if self.prep else video)
+        # bytes sent
+        self.metrics.inc('upload_bytes_total', os.path.getsize(data), media='video')
+        # post video, check response for errors
+        return self.api_rq('video', 'tumblr.create_video(video=%s, date=%s, tags=%s, kwargs=%s)' % (data, gmtstr, ltags, kwargs),
+                           self.create_media,
+                           self.blogname, type="video", state="published", format="markdown",
+                           tags=ltags, data=data, progress=progress,
+                           caption=caption, date=gmtstr + ' GMT',
+                           **kwargs)
+
+    def create_media(self, blogname, data, progress=None, **params):
+        """ create photo/video post (params type) - media file data is streamed in upload_chunk bytes chunks
+            (pytumblr loads whole file into memory) unless options upload_stream is false,
+            optional progress str s[2] echoed for every 10% sent
+        """
+        if not self.options.get("upload_stream", True):
+            return self.tumblr.create_photo(blogname, data=data, **params) if params.get("type") == "photo" else \
+                   self.tumblr.create_video(blogname, data=data, **params)
+        import requests
+        rq = self.tumblr.request
+        # the same params/url as pytumblr
+        if "." not in blogname: blogname += ".tumblr.com"
+        params = MultipartStream.form_fields(params)
+        # progress by 10%
+        def sent(cnt, size, step=[0]):
+            while progress and len(progress) > 2 and cnt * 10 >= (step[0] + 1) * size:
+                step[0] += 1
+                self.echostr(progress[2])
+        body = MultipartStream(params, "data", data, chunk=self.options.get("upload_chunk", 1 << 20), callback=sent)
+        # multipart body is not signed by oauth, so params are also in query string (as pytumblr does)
+        try:
+            resp = (self.session or requests).post(rq.host + "/v2/blog/%s/post" % blogname, data=body, params=params,
+                                 headers=dict(rq.headers, **{"Content-Type": body.content_type}),
+                                 allow_redirects=False, auth=rq.oauth)
+        finally:
+            body.close()
+        return rq.json_parse(resp)
 
     # response processing
 
@@ -335,6 +1400,10 @@ class TumblrSimple:
         meta = self.response.get("meta")
         return False if meta else True
 
+    def response_is_not_found(self):
+        """ check if response is not found error (not limiter, exhausted retries or network error) """
+        return (self.response.get("meta") or {}).get("status") == 404
+
     def get_ids_from_response(self):
         """ get list of ids from last response """
         ids = [post.get("id") for post in self.response["posts"]]
@@ -361,41 +1430,161 @@ class TumblrSimple:
 
     def get_xpath_from_response(self, xpath):
         """ get simplified xpath from response """
+        self.debug_json(7, 'TumblrSimple.get_xpath_from_response(%s) steps(%s) result:' % (xpath, Projection.compile_xpath(xpath)), self.response)
         # start from entire response
-        result = self.response
-        self.debug_json(7, 'TumblrSimple.get_xpath_from_response(%s) result:' % xpath, result)
-        # iterate all parts in xpath
-        for key in xpath.strip('/').split('/'):
-            # list[x] ?
-            m = re.match(r'^(\w+)\[(.+)\]$', key)
-            self.debug_json(7, 'TumblrSimple.get_xpath_from_response() key(%s) m(%s) result:' % (key, m.groups() if m else 'None'), result)
-            if m:
-                wkey, idx = m.group(1), int(m.group(2)) if m.group(2).isdigit() else m.group(2)
-                arr = result[wkey]
-                result = arr if idx == '' else arr[idx]
-            else:
-                result = result[key]
-        return result
+        return Projection.get_xpath(self.response, xpath)
+
+    def project_response(self, projection):
+        """ get list of records with projection fields for all posts from response in one pass """
+        return projection.project_all(self.response.get("posts", []))
 
     # tumblrsimple methods to be called
 
-    def list_posts_ids(self):
-        """ list all posts id(s) """
-        if not self.posts_rq():
+    def iter_posts(self, tag=None, limit=None, prefetch=None, projection=None):
+        """ generate all posts (optionally tagged with tag) page by page as they arrive, max limit posts, optional prefetch of the next page
+
+            pages are walked by cursor (options page_cursor) offset or before (timestamp of the last post + 1 and offset
+            over posts of that second already generated),
+            after iteration self.response is the last page or error response.
+            With optional projection (Projection or dict name -> post xpath) compact records are generated instead of posts
+            and raw posts of the page are dropped from response as soon as the page is projected
+        """
+        if isinstance(projection, dict):
+            projection = Projection(projection)
+        page = self.options.get("page_size", 20)
+        cursor = self.options.get("page_cursor", "offset")
+        prefetch = self.options.get("page_prefetch", True) if prefetch is None else prefetch
+
+        def fetch(params):
+            """ fetch page in own clone (also in prefetch thread) and return response """
+            twin = self.clone()
+            twin.posts_page_rq(tag, limit=page, **params)
+            return twin.response
+
+        def next_page(params, posts, boundary):
+            """ next page params or None if this is the last page """
+            if cursor == "before":
+                # posts of one second can span pages (even many pages) - the last second again, paged by offset
+                # over its posts already generated
+                return {'before': boundary[0] + 1, 'offset': len(boundary[1])}
+            offset = params.get('offset', 0) + len(posts)
+            return {'offset': offset} if offset < self.response.get("total_posts", offset + 1) else None
+
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            # before cursor - timestamp and ids of posts of the last second already generated
+            params, cnt, boundary = {}, 0, (None, set())
+            self.response = fetch(params)
+            while self.response_is_ok():
+                posts = self.response.get("posts", [])
+                if not posts: break
+                if cursor == "before":
+                    stamp = posts[-1]["timestamp"]
+                    last = set([int(post["id"]) for post in posts if post["timestamp"] == stamp])
+                    posts = [post for post in posts if post["timestamp"] != boundary[0] or int(post["id"]) not in boundary[1]]
+                    # no progress (server ignores offset) - stop with error rather than skip or repeat posts
+                    if not posts:
+                        self.response = {"meta": {"status": 400, "msg": "Bad Request"},
+                                         "errors": [{"title": "Paging Error", "code": 0,
+                                                     "detail": "before cursor made no progress at timestamp %s" % stamp}]}
+                        break
+                    boundary = (stamp, last | boundary[1] if stamp == boundary[0] else last)
+                    nparams = next_page(params, posts, boundary)
+                    self.response["posts"] = posts
+                else:
+                    nparams = next_page(params, posts, None)
+                # the next page params and limit check
+                if limit is not None and cnt + len(posts) >= limit: nparams = None
+                # prefetch the next page while the current one is processed
+                future = pool.submit(fetch, nparams) if pool and nparams else None
+                # project page in one pass and drop raw posts
+                if projection:
+                    posts = self.project_response(projection)
+                    self.response = dict([(key, val) for key, val in self.response.items() if key != "posts"])
+                for post in posts:
+                    if limit is not None and cnt >= limit: break
+                    cnt += 1
+                    yield post
+                if not nparams: break
+                params = nparams
+                self.response = future.result() if future else fetch(params)
+        finally:
+            if pool: pool.shutdown()
+
+    def indexed(self):
+        """ local index is enabled and synced - can be used for listings and tag lookups """
+        return self.index is not None and self.index.synced() is not None
+
+    def iter_posts_tags(self, limit=None):
+        """ generate (id, [tags]) for all posts - from local index if enabled """
+        if self.indexed():
+            yield from self.index.iter_tags(limit=limit)
+            return
+        for rec in self.iter_posts(limit=limit, projection={'id': '/id', 'tags': '/tags'}):
+            yield rec.id, rec.tags or []
+
+    def iter_tagged_ids(self, tag=None, limit=None):
+        """ generate ids of all posts (optionally tagged with tag) - tag lookup from local index if enabled """
+        if tag and self.indexed():
+            yield from self.index.find_tag(tag, limit=limit)
+            return
+        for rec in self.iter_posts(tag=tag, limit=limit, projection={'id': '/id'}):
+            yield rec.id
+
+    def iter_records(self, fields=None, tag=None, limit=None):
+        """ generate dicts of fields (name -> post xpath, default Projection.default) for all posts (optionally tagged with tag)
+            one by one as pages arrive - from local index if enabled and all fields are kept in the index
+        """
+        projection = Projection(fields or Projection.default)
+        if self.indexed() and all([steps and steps[0] in Projection.indexed for name, steps in projection.fields]):
+            for post in self.index.iter_posts(tag=tag, limit=limit):
+                yield projection.project(self.index.as_post(post)).as_dict()
+            return
+        for rec in self.iter_posts(tag=tag, limit=limit, projection=projection):
+            yield rec.as_dict()
+
+    def sync_index(self, full=False):
+        """ sync local index with new posts - until a full page of already indexed posts (all posts and remove deleted if full),
+            return number of synced posts or None if error
+        """
+        start, page = time.time(), self.options.get("page_size", 20)
+        seen, batch, known = set(), [], 0
+        for post in self.iter_posts():
+            # incremental - stop after a full page of indexed posts in a row, not at the newest indexed timestamp:
+            # posts are listed by (backdated) date, so new posts can follow older ones
+            if not full:
+                known = known + 1 if self.index.get(post["id"]) else 0
+                if known > page: break
+            seen.add(int(post["id"]))
+            batch.append(post)
+            # write in transactions of 100 posts
+            if len(batch) >= 100:
+                self.index.put(batch)
+                batch = []
+        self.index.put(batch)
+        if not self.response_is_ok():
             return None
-        return self.get_ids_from_response()
+        # remove posts deleted on server
+        if full:
+            self.index.keep(seen)
+        self.index.set_synced(start)
+        return len(seen)
 
-    def list_posts_tags(self):
+    def list_posts_ids(self, limit=None):
         """ list all posts id(s) """
-        if not self.posts_rq():
-            return None
-        return self.get_tags_from_response()
+        ids = [rec.id for rec in self.iter_posts(limit=limit, projection={'id': '/id'})]
+        return ids if self.response_is_ok() else None
+
+    def list_posts_tags(self, limit=None):
+        """ list all posts id(s) """
+        tags = dict(self.iter_posts_tags(limit=limit))
+        return tags if self.response_is_ok() else None
 
-    def find_tag_get_ids(self, tag):
+    def find_tag_get_ids(self, tag, limit=None):
         """ get post ids [list]  with tag tag """
-        if not self.find_tag_rq(tag=tag):
-            return None
-        return self.get_ids_from_response()
+        ids = list(self.iter_tagged_ids(tag=tag, limit=limit))
+        return ids if self.response_is_ok() else None
 
     def find_id_get_xpath(self, id, xpath):
         """ get xpath for specific id """
@@ -408,8 +1597,15 @@ class TumblrSimple:
         return self.find_id_get_xpath(id, xpath='/posts[0]')
 
     def find_id_get_tags(self, id):
-        """ get post for specific id """
-        return self.find_id_get_xpath(id, xpath='/posts[0]/tags')
+        """ get post tags for specific id - from local index if enabled and indexed """
+        tags = self.index.get_tags(id) if self.index else None
+        if tags is not None:
+            return tags
+        tags = self.find_id_get_xpath(id, xpath='/posts[0]/tags')
+        # add to index
+        if self.index and tags is not None:
+            self.index.put([self.get_xpath_from_response(xpath='/posts[0]')])
+        return tags
 
     def find_id_get_state(self, id):
         """ get post state for specific id """
@@ -419,104 +1615,528 @@ class TumblrSimple:
         """ check if id is already published (transcoded abnd processed) """
         return self.find_id_get_state(id) == 'published'
 
-    def upload_photo_get_id_url(self, photo, caption, tags, progress=None, **kwargs):
-        """ upload photo with caption and tags and return id/url, pptional progress str s[0] wait, s[1] timeout """
+    # upload steps - generators yield either sleep seconds or request callable, the result of callable is sent back
+    # the same steps are driven synchronously by run_steps() or asynchronously by AsyncTumblrSimple.run_steps()
+
+    def run_steps(self, steps):
+        """ run steps generator synchronously (sleep or call request) and return its result """
+        result = None
+        while True:
+            try:
+                step = steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result = step() if callable(step) else self.sleep(step)
+
+    def manifest_steps(self, media, steps):
+        """ steps to skip upload steps of media already in manifest (return existing id/url) and record new upload to manifest,
+            latency of the whole upload (read, upload, wait) is observed in upload_seconds
+        """
+        start = time.time()
+        if not self.manifest:
+            idurl = yield from steps
+            if idurl: self.metrics.observe('upload_seconds', time.time() - start)
+            return idurl
+        # content hash and existing post - the only read phase, without manifest media is read while sent (upload phase)
+        with self.metrics.timer('upload_phase_seconds', media=self.media_type(media), phase='read'):
+            sha, idurl = yield lambda: self.manifest.lookup(media)
+        if idurl:
+            return dict(idurl, polls=0, existing=True)
         # upload
-        if not self.upload_photo_rq(photo, caption, tags, **kwargs):
+        idurl = yield from steps
+        if idurl:
+            self.manifest.record(sha, media, idurl['id'], idurl['url'])
+            self.metrics.observe('upload_seconds', time.time() - start)
+        return idurl
+
+    def journal_phase(self, phase, **fields):
+        """ record phase (and fields) of the current upload to journal, queued starts new entry unless resumed """
+        self.journal_key = self.journal.record(self.journal_key, phase, **fields)
+        return True
+
+    def journal_steps(self, phase, **fields):
+        """ step recording phase of the current upload to journal (options journal_file) if enabled """
+        if self.journal:
+            yield lambda: self.journal_phase(phase, **fields)
+
+    def index_steps(self):
+        """ step putting published post from response into local index if enabled - uploads are backdated to media date,
+            so incremental sync would not reach them
+        """
+        post = (self.response.get("posts") or [None])[0]
+        if self.index and post:
+            yield lambda: self.index.put([post])
+
+    def create_steps(self, mode, media, caption, tags, upload, resume, **fields):
+        """ steps to create post of media by upload request callable, journaled as queued and uploaded (or failed),
+            return created post id (from resume entry if created before crash) or None if upload failed
+        """
+        if resume.get('post'):
+            self.upload_data, self.upload_stamp = media, resume.get('stamp')
+            return resume['post']
+        yield from self.journal_steps('queued', media=os.path.abspath(media), mode=mode, blog=self.blogname,
+                                      caption=caption, tags=tags, **fields)
+        with self.metrics.timer('upload_phase_seconds', media=mode.split('-')[0], phase='upload'):
+            ok = yield upload
+        if not ok:
+            yield from self.journal_steps('failed', error=self.last_error())
             return None
-        # get id
         id = self.get_id_from_response()
-        # wait for server processing
-        for i in range(self.options.get("loop_wait", 100)):
-            self.sleep(self.options.get("photo_wait", 5))
-            # success if id found
-            if self.find_id_rq(id): break
-            # optional progress
-            if progress: self.echostr(progress[0])
-        # timeout waiting for server processing
-        else:
-            # optional timeout
-            if progress: self.echostr(progress[1]+' ')
+        yield from self.journal_steps('uploaded', post=id, stamp=self.upload_stamp)
+        return id
+
+    def wait_steps(self, mtype, media, id, check, progress=None, **pending):
+        """ steps to wait for server processing of created post id - checked by shared pending tracker (with pending
+            published, tag conditions) or own check request callable, return (polls, post or True) or None for timeout
+        """
+        key = self.pending.add(self.upload_stamp, id, **pending) if self.pending and self.upload_stamp else None
+        poll, polls = self.poller(mtype, media), 0
+        try:
+            for delay in self.metrics.polls(poll.delays(), media=mtype, prepared=self.upload_data != media):
+                yield delay
+                polls += 1
+                # success if done
+                post = yield (lambda: self.pending.check(self, key)) if key else check
+                if post: break
+                # still processing
+                if polls == 1:
+                    yield from self.journal_steps('processing')
+                # optional progress
+                if progress: self.echostr(progress[0])
+            # timeout waiting for server processing (unless done by final lookup by id)
+            else:
+                post = key and (yield lambda: self.pending.check(self, key, lookup=True))
+                if not post:
+                    # optional timeout
+                    if progress: self.echostr(progress[1]+' ')
+                    return None
+        finally:
+            if key: self.pending.remove(key)
+        # learn processing time
+        poll.done()
+        return polls, post
+
+    def upload_photo_steps(self, photo, caption, tags, progress=None, resume=None, **kwargs):
+        """ steps to upload photo with caption and tags and return id/url, optional progress str s[0] wait, s[1] timeout, s[2] upload 10%,
+            optional unfinished journal entry resume continues from its phase
+        """
+        resume = resume or {}
+        self.journal_key = resume.get('key')
+        # upload
+        upload = lambda: self.upload_photo_rq(photo, caption, tags, progress=progress, **kwargs)
+        id = yield from self.create_steps('photo', photo, caption, tags, upload, resume, kwargs=kwargs)
+        if id is None:
+            return None
+        # wait for server processing - success if id found
+        done = yield from self.wait_steps('photo', photo, id, lambda: self.find_id_rq(id), progress)
+        if not done:
             return None
         # get photo url
         url = self.get_xpath_from_response(xpath=self.options["photo_url"])
+        yield from self.index_steps()
+        yield from self.journal_steps('published', id=id, url=url)
         #
         return {
             'id':   id,
-            'url':  url
+            'url':  url,
+            'polls': done[0]
         }
 
-    def upload_video_get_id_url_stable_id(self, video, caption, tags, progress=None, **kwargs):
-        """ upload video with caption and tags and return id/url, optional progress string str s[0] wait, s[1] timeout """
-        # upload with added uid tag
-        if not self.upload_video_rq(video, caption, tags, **kwargs):
+    def upload_video_stable_id_steps(self, video, caption, tags, progress=None, resume=None, **kwargs):
+        """ steps to upload video with caption and tags and return id/url, optional progress string str s[0] wait, s[1] timeout, s[2] upload 10%,
+            optional unfinished journal entry resume continues from its phase
+        """
+        resume = resume or {}
+        self.journal_key = resume.get('key')
+        # upload - id is returned from upload, but the status is 'transcoding'
+        upload = lambda: self.upload_video_rq(video, caption, tags, progress=progress, **kwargs)
+        id = yield from self.create_steps('video-stable', video, caption, tags, upload, resume, kwargs=kwargs)
+        if id is None:
             return None
-        # id is returned from upload, but the status is 'transcoding'
-        id = self.get_id_from_response()
-        # wait for server processing (until status is 'published'
-        for i in range(self.options.get("loop_wait", 100)):
-            self.sleep(self.options.get("video_wait", 10))
-            # success if status = 'published'
-            if self.is_id_published(id): break
-            # optional progress
-            if progress: self.echostr(progress[0])
-        # timeout waiting for server processing
-        else:
-            # optional timeout
-            if progress: self.echostr(progress[1]+' ')
+        # wait for server processing - success if status = 'published'
+        done = yield from self.wait_steps('video', video, id, lambda: self.is_id_published(id), progress, published=True)
+        if not done:
             return None
         # result id/url
         id_url = {
             'id':  id,
-            'url': self.get_xpath_from_response(xpath=self.options["video_url"])
+            'url': self.get_xpath_from_response(xpath=self.options["video_url"]),
+            'polls': done[0]
         }
+        yield from self.index_steps()
+        yield from self.journal_steps('published', id=id, url=id_url['url'])
         #
         return id_url
 
-    def upload_video_get_id_url(self, video, caption, tags, progress=None, **kwargs):
-        """ upload video with caption and tags and return id/url, optional progress string str s[0] wait, s[1] timeout """
-        # unique id (unix timestamp) to find uploaded post after server processing
-        uid = datetime.datetime.now().strftime('%s')
-        # upload with added uid tag
-        if not self.upload_video_rq(video, caption, "%s,%s" % (uid, tags), **kwargs):
-            return None
-        # this is just temporary/processing id returned from upload
-        tid = self.get_id_from_response()
-        # wait for server processing
-        for i in range(self.options.get("loop_wait", 100)):
-            self.sleep(self.options.get("video_wait", 10))
-            # success if temporary tid not found any more - processing done
-            if not self.find_id_rq(tid): break
-        # timeout waiting for server processing
-        else:
-            return None
-        # find post by uid
-        if not self.find_tag_rq(uid):
-            return None
-        # result id/url
-        id_url = {
-            'id': self.get_ids_from_response()[0],
-            'url': self.get_xpath_from_response(xpath=self.options["video_url"])
-        }
+    def upload_video_steps(self, video, caption, tags, progress=None, resume=None, **kwargs):
+        """ steps to upload video with caption and tags and return id/url, optional progress string str s[0] wait, s[1] timeout, s[2] upload 10%,
+            optional unfinished journal entry resume continues from its phase
+        """
+        resume = resume or {}
+        self.journal_key = resume.get('key')
+        # unique id (unix timestamp + random suffix, concurrent uploads start in the same second) to find uploaded post
+        uid = resume.get('uid') or datetime.datetime.now().strftime('%s') + '%06d' % random.randrange(1000000)
+        # published before crash - only uid tag is left
+        id_url = {'id': resume['id'], 'url': resume.get('url'), 'polls': 0} if resume.get('id') else None
+        # interrupted before created post was recorded - temporary or final post may exist, find it by uid
+        if resume and not resume.get('post') and not id_url and (yield lambda: self.find_tag_rq(uid)) and self.response.get("posts"):
+            post = self.response["posts"][0]
+            if post.get("state", "published") == "published":
+                id_url = {'id': post["id"], 'url': self.get_xpath_from_response(xpath=self.options["video_url"]), 'polls': 0}
+                yield from self.index_steps()
+                yield from self.journal_steps('published', id=id_url['id'], url=id_url['url'])
+            else:
+                resume = dict(resume, post=post["id"])
+        if not id_url:
+            # upload with added uid tag - this is just temporary/processing id returned from upload
+            upload = lambda: self.upload_video_rq(video, caption, "%s,%s" % (uid, tags), progress=progress, **kwargs)
+            tid = yield from self.create_steps('video', video, caption, tags, upload, resume, kwargs=kwargs, uid=uid)
+            if tid is None:
+                return None
+            # wait for server processing - shared pending tracker finds the final post tagged uid,
+            # or own request: success if temporary tid not found any more
+            done = yield from self.wait_steps('video', video, tid, lambda: not self.find_id_rq(tid) and self.response_is_not_found(),
+                                              progress, tag=uid)
+            if not done:
+                return None
+            # find post by uid (unless already listed)
+            if not isinstance(done[1], dict) and not (yield lambda: self.find_tag_rq(uid)):
+                return None
+            # temporary id gone, but final post not listed
+            if not self.response.get("posts"):
+                self.response = {"meta": {"status": 404, "msg": "Not Found"},
+                                 "errors": [{"title": "Not Found", "code": 0, "detail": "post tagged %s not found" % uid}]}
+                yield from self.journal_steps('failed', error=self.last_error())
+                return None
+            # result id/url
+            id_url = {
+                'id': self.get_ids_from_response()[0],
+                'url': self.get_xpath_from_response(xpath=self.options["video_url"]),
+                'polls': done[0]
+            }
+            # indexed with uid tag, removal below keeps the index in sync
+            yield from self.index_steps()
+            yield from self.journal_steps('published', id=id_url['id'], url=id_url['url'])
         # remove uid tag
-        self.id_del_tags(id=id_url['id'], deltags="%s" % uid)
+        if (yield lambda: self.id_del_tags(id=id_url['id'], deltags="%s" % uid)) is not None:
+            yield from self.journal_steps('uid-tag-removed')
         #
         return id_url
 
+    def upload_media_steps(self, media, caption, tags, progress=None, **kwargs):
+        """ steps to upload photo or video (by file extension) with caption and tags and return id/url """
+        mtype = self.media_type(media)
+        if mtype == 'photo':
+            return (yield from self.manifest_steps(media, self.upload_photo_steps(media, caption, tags, progress=progress, **kwargs)))
+        if mtype == 'video':
+            return (yield from self.manifest_steps(media, self.upload_video_steps(media, caption, tags, progress=progress, **kwargs)))
+        self.response = {"meta": {"status": 415, "msg": "Unsupported Media Type"},
+                         "response": {"errors": ["unknown media type: %s" % media]}}
+        return None
+
+    def upload_photo_get_id_url(self, photo, caption, tags, progress=None, **kwargs):
+        """ upload photo with caption and tags and return id/url, pptional progress str s[0] wait, s[1] timeout, s[2] upload 10% """
+        return self.run_steps(self.manifest_steps(photo, self.upload_photo_steps(photo, caption, tags, progress=progress, **kwargs)))
+
+    def upload_video_get_id_url_stable_id(self, video, caption, tags, progress=None, **kwargs):
+        """ upload video with caption and tags and return id/url, optional progress string str s[0] wait, s[1] timeout, s[2] upload 10% """
+        return self.run_steps(self.manifest_steps(video, self.upload_video_stable_id_steps(video, caption, tags, progress=progress, **kwargs)))
+
+    def upload_video_get_id_url(self, video, caption, tags, progress=None, **kwargs):
+        """ upload video with caption and tags and return id/url, optional progress string str s[0] wait, s[1] timeout, s[2] upload 10% """
+        return self.run_steps(self.manifest_steps(video, self.upload_video_steps(video, caption, tags, progress=progress, **kwargs)))
+
+    def upload_media_get_id_url(self, media, caption, tags, progress=None, **kwargs):
+        """ upload photo or video (by file extension) with caption and tags and return id/url """
+        return self.run_steps(self.upload_media_steps(media, caption, tags, progress=progress, **kwargs))
+
+    def resume_steps(self, entry):
+        """ steps to finish unfinished journal entry from its last phase and return id/url - media is sent again only
+            if the post was not created before crash
+        """
+        media, mode = entry["media"], entry.get("mode")
+        steps = {'photo': self.upload_photo_steps, 'video-stable': self.upload_video_stable_id_steps, 'video': self.upload_video_steps}[mode]
+        steps = steps(media, entry.get("caption"), entry.get("tags"), resume=entry, **entry.get("kwargs", {}))
+        if not os.path.exists(media):
+            # media is needed only for upload (and manifest)
+            if not entry.get("post"):
+                self.journal_key = entry["key"]
+                self.journal_phase('failed', error="ERROR: media not found: %s" % media)
+                self.response = {"meta": {"status": 404, "msg": "Not Found"},
+                                 "errors": [{"title": "Not Found", "code": 0, "detail": "media not found: %s" % media}]}
+                return None
+            return (yield from steps)
+        idurl = yield from self.manifest_steps(media, steps)
+        # uploaded meanwhile (manifest) - entry is finished
+        if idurl and idurl.get('existing'):
+            self.journal_key = entry["key"]
+            self.journal_phase(self.journal.final[mode], id=idurl['id'], url=idurl['url'])
+        return idurl
+
+    def resume_uploads(self, workers=None):
+        """ finish all unfinished journal entries in worker pool (on their blogs), yield (entry, id/url, error) as each
+            one finishes, journal is compacted to still unfinished entries at the end
+        """
+        blogs = dict([(blog, blog) if isinstance(blog, str) else (blog["blog_name"], blog) for blog in self.blogs])
+
+        def resume(twin, entry):
+            if entry.get("blog", self.blogname) != self.blogname:
+                twin.use_blog(blogs.get(entry["blog"], entry["blog"]))
+            return twin.run_steps(twin.resume_steps(entry))
+
+        yield from self.pool_map(resume, self.journal.unfinished(), workers)
+        self.journal.compact()
+
+    def pool_map(self, fnc, items, workers=None):
+        """ call fnc(clone, item) for all items in bounded worker pool, yield (item, result, error) as each one finishes """
+        # number of concurrent workers
+        workers = workers or self.options.get("batch_workers", 4)
+
+        def call(item):
+            """ run in worker thread with own clone """
+            twin = self.clone()
+            try:
+                result = fnc(twin, item)
+            except Exception as e:
+                return None, "ERROR: %s - %s" % (type(e).__name__, e)
+            return result, None if result else twin.last_error() or "ERROR: timeout waiting for server processing"
+
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = dict([(pool.submit(call, item), item) for item in items])
+            for future in as_completed(futures):
+                result, err = future.result()
+                yield futures[future], result, err
+
+    def plan_batch(self, medias, tags):
+        """ plan upload of list of medias without any request - list of dicts media, type, size, date, tags
+            (metadata of all medias scanned in parallel first)
+        """
+        if self.meta:
+            self.meta.scan(medias)
+        plan = []
+        for media in medias:
+            mtype = self.media_type(media)
+            gmt, ltags = self.media_date_tags(media, tags)
+            plan.append({'media': media, 'type': mtype, 'size': os.path.getsize(media), 'date': gmt, 'tags': ltags})
+        return plan
+
+    def upload_batch(self, medias, caption, tags, workers=None, progress=None, **kwargs):
+        """ upload list of medias in worker pool, yield (media, id/url, error) as each upload finishes """
+        fnc = lambda twin, media: twin.upload_media_get_id_url(media, caption, tags, progress=progress, **kwargs)
+        # metadata of all medias in one parallel scan
+        if self.meta:
+            self.meta.scan(medias)
+        # photo preprocessing and video transcoding of all medias run in worker pools overlapped with uploads
+        if self.prep:
+            self.prep.submit(medias)
+        for media, idurl, err in self.pool_map(fnc, medias, workers):
+            yield media, idurl, err
+
+    def upload_fanout(self, media, caption, tags, blogs=None, workers=None, progress=None, **kwargs):
+        """ upload one media to main blog and all blogs (default from config) concurrently, media metadata, preprocessing
+            and hashing are done once, media already uploaded to a blog (manifest) is not uploaded to it again,
+            yield (blogname, id/url, error) as each upload finishes
+        """
+        blogs = [None] + list(self.blogs if blogs is None else blogs)
+        # prepare once - metadata, preprocessed copy, content hash (cached for manifests of all blogs)
+        if self.meta:
+            self.meta.get(media)
+        if self.manifest:
+            self.manifest.media_hash(media)
+        data = self.prep.prepared(media) if self.prep else media
+        fnc = lambda twin, blog: (twin.use_blog(blog) if blog else twin).upload_media_get_id_url(media, caption, tags, progress=progress,
+                                                                                                  data=data, **kwargs)
+        for blog, idurl, err in self.pool_map(fnc, blogs, workers or len(blogs)):
+            yield self.blogname if not blog else blog if isinstance(blog, str) else blog["blog_name"], idurl, err
+
+    def edit_post_tags(self, id, tags):
+        """ edit post id with new tags (list or Tags) and keep local index in sync, return new Tags or None if failed """
+        tgs = Tags(tags)
+        # empty string clears tags - pytumblr would send empty list as "[]"
+        if not self.edit_post_rq(id, tags=tgs.as_list() or ""):
+            return None
+        if self.index:
+            self.index.set_tags(id, tgs.as_list())
+        return tgs
+
     def id_add_tags(self, id, addtags):
-        """ add tags (csv or list) to post id """
+        """ add tags (csv or list) to post id, return new Tags (computed locally) or None if failed """
         # post-id tags
-        tgs = Tags(self.find_id_get_tags(id=id))
+        tags = self.find_id_get_tags(id=id)
+        if tags is None:
+            return None
         # add new tags
-        tgs.add(addtags)
-        # edit post with new tags
-        return self.edit_post_rq(id, tags=tgs.as_list())
+        tgs = Tags(tags).add(addtags)
+        # edit post with new tags, only if there is any change
+        return self.edit_post_tags(id, tgs) if tgs.changed(tags) else tgs
 
     def id_del_tags(self, id, deltags):
-        """ remove tags (csv or list) from post id """
+        """ remove tags (csv or list) from post id, return new Tags (computed locally) or None if failed """
         # post-id tags
-        tgs = Tags(self.find_id_get_tags(id=id))
+        tags = self.find_id_get_tags(id=id)
+        if tags is None:
+            return None
         # remove tags
-        tgs.remove(deltags)
-        # edit post with new tags
-        return self.edit_post_rq(id, tags=tgs.as_list())
+        tgs = Tags(tags).remove(deltags)
+        # edit post with new tags, only if there is any change
+        return self.edit_post_tags(id, tgs) if tgs.changed(tags) else tgs
+
+    # bulk operations
+
+    def resolve_posts(self, query=None, ids=None, limit=None):
+        """ resolve all posts tagged with query (all pages) or list of ids to list of (id, [tags])
+            tags are taken from listing or local index, None if not known without extra request
+        """
+        if ids is not None:
+            return [(id, self.index.get_tags(id) if self.index else None) for id in ids]
+        if query and self.indexed():
+            return [(id, self.index.get_tags(id)) for id in self.index.find_tag(query, limit=limit)]
+        return [(post.get("id"), post.get("tags", [])) for post in self.iter_posts(tag=query, limit=limit)]
+
+    def bulk_delete(self, query=None, ids=None, limit=None, dry_run=False, workers=None):
+        """ delete all posts tagged with query or list of ids in worker pool, yield (id, ok, error) as each one finishes,
+            dry run yields planned deletes (id, None, None) without any delete request
+        """
+        # resolve all matches first - deleting while paging would shift offsets
+        targets = [id for id, tags in self.resolve_posts(query=query, ids=ids, limit=limit)]
+        if not self.response_is_ok():
+            return
+        if dry_run:
+            for id in targets:
+                yield id, None, None
+            return
+        fnc = lambda twin, id: twin.delete_post_rq(id=id)
+        for id, ok, err in self.pool_map(fnc, targets, workers):
+            yield id, ok, err
+
+    def bulk_tags(self, addtags=None, deltags=None, query=None, ids=None, limit=None, dry_run=False, workers=None):
+        """ add/remove tags (csv or list) of all posts tagged with query or list of ids in worker pool,
+            yield (id, [new tags] or True if unchanged, error) as each one finishes,
+            dry run yields planned edits (id, [new tags], None) without any edit request
+        """
+        targets = self.resolve_posts(query=query, ids=ids, limit=limit)
+        if not self.response_is_ok():
+            return
+
+        def edit(twin, target, dry_run=False):
+            """ edit single post, reuse tags from listing or fetch them """
+            id, tags = target
+            if tags is None:
+                tags = twin.find_id_get_tags(id=id)
+                if tags is None: return None
+            # new tags
+            tgs = Tags(tags)
+            if addtags: tgs.add(addtags)
+            if deltags: tgs.remove(deltags)
+            # skip posts without any change
+            if not tgs.changed(tags):
+                return True
+            if dry_run:
+                return tgs.as_list()
+            return tgs.as_list() if twin.edit_post_tags(id, tgs) is not None else None
+
+        if dry_run:
+            for target in targets:
+                yield target[0], edit(self, target, dry_run=True), None
+            return
+        for target, result, err in self.pool_map(edit, targets, workers):
+            yield target[0], result, err
+
+
+class AsyncTumblrSimple:
+    """ asyncio variant of TumblrSimple - awaitable requests and non-blocking processing waits
+
+        requests are executed by wrapped TumblrSimple clone in executor, processing waits are asyncio.sleep()
+        so one event loop can keep hundreds of posts waiting at the same time. Each instance keeps own response,
+        use session() to get new instance for every concurrent upload
+    """
+
+    def __init__(self, tumblr, executor=None):
+        """ init from TumblrSimple instance and optional executor (default loop executor) """
+        # own clone with own response, request counts propagate to tumblr
+        self.ts = tumblr.clone()
+        self.executor = executor
+
+    def __getattr__(self, name):
+        """ delegate response processing (last_error, get_*_from_response, options ...) to wrapped clone """
+        return getattr(self.ts, name)
+
+    def session(self):
+        """ new async instance with own response sharing executor """
+        return AsyncTumblrSimple(self.ts, self.executor)
+
+    async def call(self, fnc, *args, **kwargs):
+        """ await blocking fnc(*args, **kwargs) running in executor """
+        import asyncio, functools
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fnc, *args, **kwargs))
+
+    async def run_steps(self, steps):
+        """ run steps generator asynchronously (asyncio.sleep or call request in executor) and return its result """
+        import asyncio
+        result = None
+        while True:
+            try:
+                step = steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result = await self.call(step) if callable(step) else await asyncio.sleep(step)
+
+    # tumblr requests
+
+    async def info_rq(self):
+        return await self.call(self.ts.info_rq)
+
+    async def delete_post_rq(self, id):
+        return await self.call(self.ts.delete_post_rq, id)
+
+    async def edit_post_rq(self, id, **kwargs):
+        return await self.call(self.ts.edit_post_rq, id, **kwargs)
+
+    async def posts_rq(self, **params):
+        return await self.call(self.ts.posts_rq, **params)
+
+    async def find_id_rq(self, id):
+        return await self.call(self.ts.find_id_rq, id)
+
+    async def find_tag_rq(self, tag, **params):
+        return await self.call(self.ts.find_tag_rq, tag, **params)
+
+    async def upload_photo_rq(self, photo, caption, csvtags, **kwargs):
+        return await self.call(self.ts.upload_photo_rq, photo, caption, csvtags, **kwargs)
+
+    async def upload_video_rq(self, video, caption, csvtags, **kwargs):
+        return await self.call(self.ts.upload_video_rq, video, caption, csvtags, **kwargs)
+
+    # upload and wait helpers
+
+    async def upload_photo_get_id_url(self, photo, caption, tags, progress=None, **kwargs):
+        """ upload photo with caption and tags and await id/url """
+        return await self.run_steps(self.ts.manifest_steps(photo, self.ts.upload_photo_steps(photo, caption, tags, progress=progress, **kwargs)))
+
+    async def upload_video_get_id_url_stable_id(self, video, caption, tags, progress=None, **kwargs):
+        """ upload video with caption and tags and await id/url (stable id) """
+        steps = self.ts.upload_video_stable_id_steps(video, caption, tags, progress=progress, **kwargs)
+        return await self.run_steps(self.ts.manifest_steps(video, steps))
+
+    async def upload_video_get_id_url(self, video, caption, tags, progress=None, **kwargs):
+        """ upload video with caption and tags and await id/url """
+        return await self.run_steps(self.ts.manifest_steps(video, self.ts.upload_video_steps(video, caption, tags, progress=progress, **kwargs)))
+
+    async def upload_media_get_id_url(self, media, caption, tags, progress=None, **kwargs):
+        """ upload photo or video (by file extension) with caption and tags and await id/url """
+        return await self.run_steps(self.ts.upload_media_steps(media, caption, tags, progress=progress, **kwargs))
+
+    async def upload_batch(self, medias, caption, tags, progress=None, **kwargs):
+        """ upload all medias concurrently (each in own session), async yield (media, id/url, error) as each upload finishes """
+
+        async def upload(media):
+            """ upload single media in own session """
+            session = self.session()
+            idurl = await session.upload_media_get_id_url(media, caption, tags, progress=progress, **kwargs)
+            return media, idurl, None if idurl else session.last_error() or "ERROR: timeout waiting for server processing"
+
+        import asyncio
+        for future in asyncio.as_completed([upload(media) for media in medias]):
+            yield await future
@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+
+"""
+SpoolWatcher class for watch-folder daemon uploading media files as they land in spool directory
+
+files are detected by inotify (linux, via ctypes) with polling fallback, uploaded when they stop
+growing and moved to done/failed folders. Caption and tags come from per-directory sidecar rules:
+
+    tumblr-rules.json   {"caption": "{name}", "tags": "tag1,tag2", "rules": [{"match": "*.mp4", "tags": "video"}]}
+
+rules are inherited from parent directories up to spool root, the first matching rule overrides defaults
+
+"""
+
+__VERSION__ = '2020.08.04'
+
+import os, sys, json, time, fnmatch, threading
+import ctypes, ctypes.util, select, struct
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Inotify:
+    """ minimal inotify interface via ctypes - linux only, raises OSError if not available """
+
+    IN_MODIFY       = 0x00000002
+    IN_CLOSE_WRITE  = 0x00000008
+    IN_MOVED_TO     = 0x00000080
+    IN_CREATE       = 0x00000100
+    IN_ISDIR        = 0x40000000
+
+    # watched events
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self):
+        """ init inotify instance """
+        libname = ctypes.util.find_library('c')
+        if not libname:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init'):
+            raise OSError("inotify not supported")
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        # watch descriptor -> directory
+        self.wds = {}
+
+    def add_watch(self, path):
+        """ watch directory path """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed: %s" % path)
+        self.wds[wd] = path
+
+    def read(self, timeout):
+        """ wait max timeout seconds for events, return list of (full path, mask) """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        buf, events, pos = os.read(self.fd, 64 * 1024), [], 0
+        # struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+        while pos + 16 <= len(buf):
+            wd, mask, cookie, size = struct.unpack_from('iIII', buf, pos)
+            name = buf[pos + 16:pos + 16 + size].rstrip(b'\0')
+            pos += 16 + size
+            if wd in self.wds:
+                events.append((os.path.join(self.wds[wd], os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SpoolWatcher:
+    """ watch spool directory and upload media files as they land """
+
+    # sidecar rules filename
+    rules_file = 'tumblr-rules.json'
+
+    def __init__(self, tumblr, spool, options=None):
+        """ init with TumblrSimple instance, spool directory and options (watch_* keys of tumblr options by default) """
+        options = tumblr.options if options is None else options
+        self.tumblr = tumblr
+        self.spool = os.path.abspath(spool)
+        # done/failed folders (relative to spool)
+        self.done = os.path.join(self.spool, options.get("watch_done", "done"))
+        self.failed = os.path.join(self.spool, options.get("watch_failed", "failed"))
+        # file is finished if size and mtime did not change for settle seconds
+        self.settle = options.get("watch_settle", 5)
+        # polling interval (also max inotify wait)
+        self.interval = options.get("watch_interval", 2)
+        self.workers = options.get("batch_workers", 4)
+        # path -> (size, mtime, stable since)
+        self.pending = {}
+        # queued (uploading) paths
+        self.queued = set()
+        # processed (uploaded or failed) paths not moved yet -> done/failed folder, moved again every round
+        self.unmoved = {}
+        self.inotify = None
+        # one output line at a time from worker threads
+        self.lock = threading.Lock()
+
+    def echo(self, *args):
+        """ print one line and flush under lock - workers print concurrently, daemon output is usually redirected """
+        line = ' '.join(["%s" % arg for arg in args]) + '\n'
+        with self.lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+    def dirs(self):
+        """ generate all spool directories except done/failed folders """
+        for root, dirnames, filenames in os.walk(self.spool):
+            dirnames[:] = [d for d in dirnames if os.path.join(root, d) not in (self.done, self.failed)]
+            yield root
+
+    def start_inotify(self):
+        """ start inotify watches, return False to use polling fallback """
+        try:
+            self.inotify = Inotify()
+            for d in self.dirs():
+                self.inotify.add_watch(d)
+        except OSError as e:
+            self.echo("WATCH: inotify not available (%s), polling every %ss" % (e, self.interval))
+            self.inotify = None
+        return self.inotify is not None
+
+    def scan(self):
+        """ add all media files in spool to pending """
+        for d in self.dirs():
+            for name in os.listdir(d):
+                self.touch(os.path.join(d, name))
+
+    def touch(self, path):
+        """ file (or new directory) changed - add media to pending """
+        if os.path.isdir(path):
+            # new subdirectory - watch it and pick up its files
+            if self.inotify and path not in self.inotify.wds.values() and path not in (self.done, self.failed):
+                self.inotify.add_watch(path)
+                for name in os.listdir(path):
+                    self.touch(os.path.join(path, name))
+            return
+        if path in self.queued or path in self.unmoved or not os.path.isfile(path) or not self.tumblr.media_type(path):
+            return
+        self.pending.setdefault(path, (-1, -1, time.time()))
+
+    def stable(self):
+        """ list of pending files which stopped growing for settle seconds """
+        now, ready = time.time(), []
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                # vanished
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                self.pending[path] = (st.st_size, st.st_mtime, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                ready.append(path)
+        return ready
+
+    def rules(self, path):
+        """ caption and tags for media path from sidecar rules of its directory and parents """
+        cfg = {"caption": "", "tags": ""}
+        # directories from spool root down to media directory
+        rel = os.path.relpath(os.path.dirname(path), self.spool)
+        parts = [] if rel == '.' else rel.split(os.sep)
+        for i in range(len(parts) + 1):
+            sidecar = os.path.join(self.spool, *(parts[:i] + [self.rules_file]))
+            try:
+                with open(sidecar, "r") as f:
+                    rules = json.loads(f.read())
+            except (IOError, ValueError):
+                continue
+            cfg.update(dict([(k, v) for k, v in rules.items() if k in ("caption", "tags")]))
+            # the first matching rule overrides defaults
+            for rule in rules.get("rules", []):
+                if fnmatch.fnmatch(os.path.basename(path), rule.get("match", "*")):
+                    cfg.update(dict([(k, v) for k, v in rule.items() if k in ("caption", "tags")]))
+                    break
+        # caption template
+        name = os.path.basename(path)
+        fmt = {'name': name, 'base': os.path.splitext(name)[0], 'dir': os.path.basename(os.path.dirname(path))}
+        return cfg["caption"].format(**fmt), cfg["tags"].format(**fmt)
+
+    def move(self, path, folder):
+        """ move processed media to done/failed folder keeping relative path, return new path """
+        dst = os.path.join(folder, os.path.relpath(path, self.spool))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(path, dst)
+        return dst
+
+    def upload(self, twin, path):
+        """ upload single media in worker clone and move it to done/failed folder """
+        try:
+            caption, tags = self.rules(path)
+            try:
+                idurl = twin.upload_media_get_id_url(path, caption, tags)
+                err = None if idurl else twin.last_error() or "ERROR: timeout waiting for server processing"
+            except Exception as e:
+                idurl, err = None, "ERROR: %s - %s" % (type(e).__name__, e)
+            folder = self.done if idurl else self.failed
+            try:
+                self.move(path, folder)
+            except OSError as e:
+                # not uploaded again by later events or scans, the move is retried
+                with self.lock:
+                    self.unmoved[path] = folder
+                self.echo("MEDIA:", path, "ERROR: move failed (retried) - %s" % e)
+        finally:
+            self.queued.discard(path)
+        if idurl:
+            self.echo("MEDIA:", path, "ID:", idurl['id'], "URL:", idurl['url'])
+        else:
+            self.echo("MEDIA:", path, err)
+        return idurl
+
+    def retry_moves(self):
+        """ move processed media again if their move to done/failed folder failed """
+        with self.lock:
+            unmoved = list(self.unmoved.items())
+        for path, folder in unmoved:
+            try:
+                # vanished (moved or removed by user) is done too
+                if os.path.exists(path):
+                    self.move(path, folder)
+            except OSError:
+                continue
+            with self.lock:
+                self.unmoved.pop(path, None)
+
+    def report_error(self, path, future):
+        """ log exception of upload worker (sidecar rules or move failed) - otherwise lost in future """
+        e = future.exception()
+        if e is not None:
+            self.echo("MEDIA:", path, "ERROR: %s - %s" % (type(e).__name__, e))
+
+    def run(self, forever=True):
+        """ watch spool and upload files with one persistent tumblr session, run once if not forever """
+        self.start_inotify()
+        # files already in spool
+        self.scan()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                if self.inotify:
+                    for path, mask in self.inotify.read(self.interval if not self.pending else min(self.interval, self.settle)):
+                        self.touch(path)
+                else:
+                    time.sleep(self.interval)
+                    self.scan()
+                self.retry_moves()
+                for path in self.stable():
+                    self.queued.add(path)
+                    future = pool.submit(self.upload, self.tumblr.clone(), path)
+                    future.add_done_callback(lambda future, path=path: self.report_error(path, future))
+                if not forever and not self.pending:
+                    break
+        self.retry_moves()
+        if self.inotify:
+            self.inotify.close()